@@ -0,0 +1,555 @@
+#!/usr/bin/env python3
+"""
+Asyncio entry point for the same bot (python async_bot.py).
+
+Commands and flows mirror bot.py, storage and parsing come from botcore.py; this module swaps the
+synchronous TeleBot for AsyncTeleBot so downloads, uploads and replies for thousands
+of chats wait on one event loop and one pooled aiohttp session, while parsing and
+VCF building run in a process pool.
+
+bot.py only: /resume (jobs are not persisted here), /profile and the /metrics
+endpoint with its per-stage timings.
+"""
+
+import os
+import asyncio
+import itertools
+import shutil
+import tempfile
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import List, Tuple
+
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException, ApiHTTPException
+
+import botcore as core
+from botcore import (
+    HELP_TEXT, ADMIN_KEY, DEFAULT_COUNTRY_CODE, ZIP_THRESHOLD, ZIP_LEVEL, ZIP_MAX_BYTES,
+    TokenBucket, SessionQuotaExceeded, UploadTooLarge, CpuTimeout, check_download_size,
+    is_allowed, is_admin, is_owner, get_owner_id,
+    add_user_ids, parse_user_ids, remove_user_id, add_admin_id, remove_admin_id,
+    parse_txt_contacts, parse_vcf_to_contacts, parse_sheet_contacts, parse_and_dedup,
+    parse_dedup_mode, dedup_note, vcf_to_txt_file, merge_vcf_file, merge_txt_file,
+    build_vcf_chunk, build_txt_chunk, bundle_zip, generate_sequence_from_template,
+    user_sessions, merge_vcf_store, merge_txt_store, get_conversion_cache,
+)
+
+# HELP_TEXT without the commands only bot.py handles
+ASYNC_HELP_TEXT = "\n".join(line for line in HELP_TEXT.split("\n")
+                            if not line.lstrip(" -").startswith(("/resume", "/profile")))
+
+# one aiohttp connector shared by every API call, download and upload
+asyncio_helper.REQUEST_LIMIT = int(os.getenv("ASYNC_HTTP_LIMIT", 100))
+ASYNC_MAX_JOBS = int(os.getenv("ASYNC_MAX_JOBS", 64))   # jobs doing work at once
+MAX_QUEUED_JOBS = core.MAX_QUEUED_JOBS
+PER_USER_JOBS = core.PER_USER_JOBS
+
+abot = AsyncTeleBot(core.BOT_TOKEN)
+
+# ---------------------------
+# pacing (async twin of bot.Outbox)
+# ---------------------------
+_global_bucket = TokenBucket(core.OUTBOX_GLOBAL_RATE, core.OUTBOX_GLOBAL_RATE)
+_chat_buckets = {}
+_chat_send_locks = {}   # chat_id -> [lock, callers]; dropped when the last caller is done
+CHAT_STATE_MAX = 10000  # idle chats' buckets / job slots are dropped past this many (as bot.Outbox)
+
+async def _take(bucket: TokenBucket):
+    while True:
+        d = bucket.delay()
+        if d <= 0:
+            bucket.consume()
+            return
+        await asyncio.sleep(d)
+
+async def call(chat_id, fn, *args, **kwargs):
+    # FIFO per chat, paced per chat and globally, 429 retry_after honoured
+    entry = _chat_send_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            bucket = _chat_buckets.get(chat_id)
+            if bucket is None:
+                if len(_chat_buckets) >= CHAT_STATE_MAX:
+                    for c in [c for c in _chat_buckets if c not in _chat_send_locks]:
+                        del _chat_buckets[c]
+                bucket = _chat_buckets[chat_id] = TokenBucket(core.OUTBOX_CHAT_RATE, core.OUTBOX_CHAT_BURST)
+            for attempt in itertools.count():
+                await _take(bucket)
+                await _take(_global_bucket)
+                try:
+                    return await fn(*args, **kwargs)
+                except ApiTelegramException as e:
+                    if e.error_code != 429 or attempt >= core.OUTBOX_MAX_RETRIES:
+                        raise
+                    retry_after = (e.result_json or {}).get("parameters", {}).get("retry_after", 1)
+                    await asyncio.sleep(retry_after)
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            _chat_send_locks.pop(chat_id, None)
+
+async def send_message(chat_id, text, **kwargs):
+    try:
+        return await call(chat_id, abot.send_message, chat_id, text, **kwargs)
+    except Exception as e:
+        print(f"send failed: {e}")
+
+async def send_path(chat_id, path: str, filename: str):
+    with open(path, "rb") as fh:
+        async def upload():
+            fh.seek(0)
+            return await abot.send_document(chat_id, fh, visible_file_name=filename)
+        return await call(chat_id, upload)
+
+async def deny(chat_id):
+    await send_message(chat_id, "Purchase access from @random_0988")
+
+# ---------------------------
+# jobs
+# ---------------------------
+_cpu_pool = ProcessPoolExecutor(core.CPU_WORKERS) if core.CPU_WORKERS > 0 else None
+_job_slots = asyncio.Semaphore(ASYNC_MAX_JOBS)
+_chat_slots = {}
+_chat_tasks = {}
+_waiting = 0
+
+async def cpu(fn, *args):
+    global _cpu_pool
+    loop = asyncio.get_running_loop()
+    if _cpu_pool is None:
+        return await asyncio.to_thread(fn, *args)
+    if core.prewarm_pending():
+        # the pool forks on first submit; don't fork mid-import (see JobScheduler._cpu_pool)
+        await asyncio.to_thread(core.wait_prewarm)
+    while True:
+        pool = _cpu_pool
+        task = pool.submit(fn, *args)
+        fut = asyncio.wrap_future(task)
+        deadline = None   # CPU_TIMEOUT counts from when the task starts running
+        try:
+            while not fut.done():
+                await asyncio.wait({fut}, timeout=0.5)
+                if deadline is None and task.running():
+                    deadline = loop.time() + core.CPU_TIMEOUT
+                if not fut.done() and deadline is not None and loop.time() > deadline:
+                    if _cpu_pool is pool:
+                        _cpu_pool = ProcessPoolExecutor(core.CPU_WORKERS)
+                        core.terminate_pool(pool)
+                    raise CpuTimeout("Processing took too long and was stopped. Please try a smaller file.")
+            return fut.result()
+        except BrokenProcessPool:
+            if _cpu_pool is pool:
+                raise
+            # another task's timeout recycled the pool under this one; run it again
+        finally:
+            fut.cancel()
+
+async def io(fn, *args):
+    # SQLite / disk-backed stores are blocking; keep them off the loop
+    return await asyncio.to_thread(fn, *args)
+
+async def _run_job(chat_id, coro):
+    global _waiting
+    if chat_id not in _chat_slots and len(_chat_slots) >= CHAT_STATE_MAX:
+        for c in [c for c in _chat_slots if c not in _chat_tasks]:
+            del _chat_slots[c]
+    chat_slot = _chat_slots.setdefault(chat_id, asyncio.Semaphore(PER_USER_JOBS))
+    _waiting += 1
+    started = False
+    try:
+        async with chat_slot:
+            async with _job_slots:
+                _waiting -= 1
+                started = True
+                await coro
+    except asyncio.CancelledError:
+        pass
+    except (SessionQuotaExceeded, UploadTooLarge, CpuTimeout) as e:
+        await send_message(chat_id, str(e))
+    except Exception:
+        traceback.print_exc()
+        await send_message(chat_id, "Something went wrong while processing your request.")
+    finally:
+        if not started:
+            # cancelled while still queued
+            _waiting -= 1
+            coro.close()
+
+def submit_job(chat_id, coro):
+    if _waiting >= MAX_QUEUED_JOBS:
+        coro.close()
+        asyncio.create_task(send_message(chat_id, "Bot is busy right now, please try again in a minute."))
+        return None
+    if _job_slots.locked():
+        asyncio.create_task(send_message(chat_id, f"Busy, you are #{_waiting + 1} in queue."))
+    task = asyncio.create_task(_run_job(chat_id, coro))
+    _chat_tasks.setdefault(chat_id, set()).add(task)
+    task.add_done_callback(lambda t: _task_done(chat_id, t))
+    return task
+
+def _task_done(chat_id, task):
+    tasks = _chat_tasks.get(chat_id)
+    if tasks is not None:
+        tasks.discard(task)
+        if not tasks:
+            del _chat_tasks[chat_id]
+
+def cancel_jobs(chat_id):
+    for task in list(_chat_tasks.get(chat_id, ())):
+        task.cancel()
+
+async def start_flow(chat_id, flow: str, **extra):
+    cancel_jobs(chat_id)
+    await io(user_sessions.__setitem__, chat_id, {'flow': flow, **extra})
+
+# ---------------------------
+# command handlers
+# ---------------------------
+@abot.message_handler(commands=['start','help'])
+async def handle_help(msg):
+    if not await io(is_allowed, msg.from_user.id):
+        await deny(msg.chat.id); return
+    await send_message(msg.chat.id, ASYNC_HELP_TEXT)
+
+@abot.message_handler(commands=['admin'])
+async def handle_admin(msg):
+    parts = msg.text.strip().split()
+    if len(parts) < 2:
+        await send_message(msg.chat.id, "Usage: /admin <admin_key> (owner only)"); return
+    if parts[1] != ADMIN_KEY:
+        await send_message(msg.chat.id, "Invalid admin key."); return
+    if not await io(is_owner, msg.from_user.id):
+        await send_message(msg.chat.id, "Only owner can activate admin via this."); return
+    await io(add_admin_id, msg.from_user.id)
+    await send_message(msg.chat.id, "You are now an admin (owner is always admin).")
+
+def _target_id(parts: List[str], idx: int):
+    try:
+        return int(parts[idx])
+    except (IndexError, ValueError):
+        return None
+
+@abot.message_handler(commands=['adduser'])
+async def handle_adduser(msg):
+    if not await io(is_admin, msg.from_user.id):
+        await send_message(msg.chat.id, "Only admin/owner can add users."); return
+    ids, bad = parse_user_ids(msg.text)
+    if bad:
+        await send_message(msg.chat.id, f"telegram_user_id must be a number: {' '.join(bad[:10])}"); return
+    if not ids:
+        await send_message(msg.chat.id, "Usage: /adduser <telegram_user_id> [more ids...]"); return
+    added = await io(add_user_ids, ids)
+    if len(ids) == 1:
+        await send_message(msg.chat.id, f"User {ids[0]} added to allowed users.")
+    else:
+        await send_message(msg.chat.id, f"{added} of {len(ids)} users added to allowed users ({len(ids) - added} already present).")
+
+@abot.message_handler(commands=['removeuser'])
+async def handle_removeuser(msg):
+    if not await io(is_admin, msg.from_user.id):
+        await send_message(msg.chat.id, "Only admin/owner can remove users."); return
+    parts = msg.text.strip().split()
+    if len(parts) < 2:
+        await send_message(msg.chat.id, "Usage: /removeuser <telegram_user_id>"); return
+    tid = _target_id(parts, 1)
+    if tid is None:
+        await send_message(msg.chat.id, "telegram_user_id must be a number"); return
+    if tid == await io(get_owner_id):
+        await send_message(msg.chat.id, "BAAP SE PANGA NHI 😁"); return
+    await io(remove_user_id, tid)
+    await send_message(msg.chat.id, f"User {tid} removed from allowed users.")
+
+@abot.message_handler(commands=['addadmin', 'removeadmin'])
+async def handle_admin_change(msg):
+    parts = msg.text.strip().split()
+    cmd = parts[0].lstrip("/").split("@")[0]
+    if len(parts) < 3:
+        await send_message(msg.chat.id, f"Usage: /{cmd} <admin_key> <telegram_user_id>"); return
+    tid = _target_id(parts, 2)
+    if tid is None:
+        await send_message(msg.chat.id, "telegram_user_id must be a number"); return
+    if parts[1] != ADMIN_KEY:
+        await send_message(msg.chat.id, "Invalid admin key"); return
+    if cmd == "addadmin":
+        await io(add_admin_id, tid)
+        await send_message(msg.chat.id, f"Added admin {tid}."); return
+    if tid == await io(get_owner_id):
+        await send_message(msg.chat.id, "BAAP SE PANGA NHI 😁"); return
+    await io(remove_admin_id, tid)
+    await send_message(msg.chat.id, f"Removed admin {tid}.")
+
+# ---------------------------
+# flows start
+# ---------------------------
+_FLOW_PROMPTS = {
+    'txt2vcf': ('txt2vcf_wait_file', "Send the TXT file as a *document*. Each line: phone OR name,phone OR name<TAB>phone"),
+    'xlsx2vcf': ('xlsx2vcf_wait_file', "Send the XLSX (or CSV) file as a *document*. Bot will try to detect columns"),
+    'vcf2txt': ('vcf2txt_wait_file', "Send the VCF file as a document"),
+    'split_vcf': ('split_vcf_wait_file', "Send VCF file as document to split"),
+    'split_txt': ('split_txt_wait_file', "Send TXT file as document to split"),
+    'adminneavy': ('adminneavy_wait_admin_number', "Enter ADMIN number (phone):"),
+}
+
+@abot.message_handler(commands=list(_FLOW_PROMPTS))
+async def cmd_flow(msg):
+    if not await io(is_allowed, msg.from_user.id):
+        await deny(msg.chat.id); return
+    cmd = msg.text.split()[0].lstrip("/").split("@")[0]
+    flow, prompt = _FLOW_PROMPTS[cmd]
+    await start_flow(msg.chat.id, flow, dedup=parse_dedup_mode(msg.text))
+    await send_message(msg.chat.id, prompt, parse_mode='Markdown' if '*' in prompt else None)
+
+@abot.message_handler(commands=['merge_vcf', 'merge_txt'])
+async def cmd_merge(msg):
+    if not await io(is_allowed, msg.from_user.id):
+        await deny(msg.chat.id); return
+    cancel_jobs(msg.chat.id)
+    if msg.text.split()[0].lstrip("/").startswith("merge_vcf"):
+        await io(merge_vcf_store.start, msg.chat.id)
+        await send_message(msg.chat.id, "Send VCF files (documents) one by one. When done send /done_merge")
+    else:
+        await io(merge_txt_store.start, msg.chat.id)
+        await send_message(msg.chat.id, "Send TXT files (documents) one by one. When done send /done_merge_txt")
+
+@abot.message_handler(commands=['done_merge', 'done_merge_txt'])
+async def cmd_done_merge(msg):
+    if not await io(is_allowed, msg.from_user.id):
+        await deny(msg.chat.id); return
+    txt = msg.text.split()[0].lstrip("/").startswith("done_merge_txt")
+    submit_job(msg.chat.id, _done_merge(msg.chat.id, txt, parse_dedup_mode(msg.text)))
+
+async def _done_merge(chat_id, txt: bool, dedup: str):
+    store, builder, outname = (merge_txt_store, merge_txt_file, "merged.txt") if txt else \
+                              (merge_vcf_store, merge_vcf_file, "merged.vcf")
+    col = await io(store.paths, chat_id)
+    if not col:
+        await send_message(chat_id, "No files collected"); return
+    path = core._temp_path(Path(outname).suffix)
+    try:
+        count, dropped = await cpu(builder, col, path, dedup)
+        await io(store.pop, chat_id)
+        if not count:
+            await send_message(chat_id, "No contacts parsed"); return
+        await send_path(chat_id, path, outname)
+        if dedup:
+            await send_message(chat_id, f"Merged {outname}" + dedup_note(dropped))
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+# ---------------------------
+# document handler
+# ---------------------------
+async def download_to_file(file_path: str, suffix: str = "") -> Path:
+    # async twin of bot.download_to_file: streams over AsyncTeleBot's shared
+    # aiohttp session, same DOWNLOAD_CHUNK pieces and size cap
+    if asyncio_helper.FILE_URL is None:
+        url = f"https://api.telegram.org/file/bot{abot.token}/{file_path}"
+    else:
+        url = asyncio_helper.FILE_URL.format(abot.token, file_path)
+    path = Path(core._temp_path(suffix))
+    try:
+        total = 0
+        session = await asyncio_helper.session_manager.get_session()
+        async with session.get(url, proxy=asyncio_helper.proxy) as resp:
+            if resp.status != 200:
+                raise ApiHTTPException('Download file', resp)
+            with open(path, "wb") as out:
+                async for chunk in resp.content.iter_chunked(core.DOWNLOAD_CHUNK):
+                    total += len(chunk)
+                    check_download_size(total)
+                    out.write(chunk)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return path
+
+@abot.message_handler(content_types=['document'])
+async def handle_document(msg):
+    if not await io(is_allowed, msg.from_user.id):
+        await deny(msg.chat.id); return
+    submit_job(msg.chat.id, _document_job(msg))
+
+async def _document_job(msg):
+    downloaded = []
+    try:
+        await _handle_upload(msg, downloaded)
+    finally:
+        for path in downloaded:
+            path.unlink(missing_ok=True)
+
+async def _handle_upload(msg, downloaded: List[Path]):
+    chat_id = msg.chat.id
+    doc = msg.document
+    fname = doc.file_name or ""
+    low = fname.lower()
+    sess = await io(user_sessions.get, chat_id, {})
+    flow = sess.get('flow')
+    dedup = sess.get('dedup')
+
+    async def fetch() -> Path:
+        if not downloaded:
+            check_download_size(doc.file_size)
+            file_info = await call(chat_id, abot.get_file, doc.file_id)
+            downloaded.append(await download_to_file(file_info.file_path, Path(fname).suffix))
+        return downloaded[0]
+
+    async def parse(parse_fn, *extra):
+        key = ("parse", doc.file_unique_id, parse_fn.__name__, dedup, extra)
+        hit = await io(get_conversion_cache().get, *key)
+        if hit is not None:
+            return hit
+        res = await cpu(parse_and_dedup, dedup, parse_fn, await fetch(), *extra)
+        await io(get_conversion_cache().put, res, *key)
+        return res
+
+    async def reply(text, end=True):
+        await send_message(chat_id, text)
+        if end:
+            await io(user_sessions.pop, chat_id, None)
+
+    if low.endswith('.vcf') and await io(merge_vcf_store.__contains__, chat_id):
+        n = await io(merge_vcf_store.append, chat_id, await fetch())
+        await send_message(chat_id, f"Collected {n} vcf(s). Send more or /done_merge"); return
+    if low.endswith('.txt') and await io(merge_txt_store.__contains__, chat_id):
+        n = await io(merge_txt_store.append, chat_id, await fetch())
+        await send_message(chat_id, f"Collected {n} txt(s). Send more or /done_merge_txt"); return
+
+    if flow in ('txt2vcf_wait_file', 'split_txt_wait_file'):
+        if not low.endswith('.txt'):
+            await reply("Please send a .txt file as document"); return
+        contacts, dropped = await parse(parse_txt_contacts, DEFAULT_COUNTRY_CODE)
+    elif flow == 'xlsx2vcf_wait_file':
+        if not low.endswith(('.xlsx', '.xls', '.csv')):
+            await reply("Please send an Excel (.xlsx) or .csv file as document"); return
+        try:
+            contacts, dropped = await parse(parse_sheet_contacts, fname)
+        except Exception as e:
+            await reply(f"Failed to parse Excel: {e}"); return
+    elif flow == 'split_vcf_wait_file':
+        if not low.endswith('.vcf'):
+            await reply("Please send a .vcf file."); return
+        contacts, dropped = await parse(parse_vcf_to_contacts)
+    elif flow == 'vcf2txt_wait_file':
+        if not low.endswith('.vcf'):
+            await reply("Please send a .vcf file."); return
+        outname = Path(fname).stem + ".txt"
+        out_key = ("out", doc.file_unique_id, "vcf2txt", outname)
+        file_id = await io(get_conversion_cache().get, *out_key)
+        if file_id:
+            await call(chat_id, abot.send_document, chat_id, file_id)
+            await io(user_sessions.pop, chat_id, None); return
+        path = core._temp_path(".txt")
+        try:
+            if not await cpu(vcf_to_txt_file, await fetch(), path):
+                await reply("No contacts found in VCF."); return
+            sent = await send_path(chat_id, path, outname)
+        finally:
+            os.unlink(path)
+        if sent is not None and getattr(sent, "document", None):
+            await io(get_conversion_cache().put, sent.document.file_id, *out_key)
+        await io(user_sessions.pop, chat_id, None); return
+    else:
+        return
+
+    if not contacts:
+        await reply("No contacts parsed"); return
+    nxt = {'txt2vcf_wait_file': 'txt2vcf_wait_options', 'xlsx2vcf_wait_file': 'xlsx2vcf_wait_options',
+           'split_vcf_wait_file': 'split_vcf_wait_count', 'split_txt_wait_file': 'split_txt_wait_count'}[flow]
+    await io(user_sessions.__setitem__, chat_id, {'flow': nxt, 'contacts': contacts, 'source': doc.file_unique_id,
+                                                  'dedup': dedup, 'stem': Path(fname).stem})
+    if nxt.endswith('_options'):
+        await send_message(chat_id, f"Found {len(contacts)} contacts{dedup_note(dropped)}.\nReply with options:\n<contacts_per_vcf>,<vcf_prefix>,<contact_name_prefix>\nOR: single,<vcf_prefix>,<contact_name_prefix>\nYou can give sequence template like 'A2D' or explicit 'A2D A3D A4D'")
+    else:
+        kind = "VCF" if nxt == 'split_vcf_wait_count' else "TXT"
+        await send_message(chat_id, f"Found {len(contacts)} contacts{dedup_note(dropped)}.\nEnter number of contacts per output {kind} (integer):")
+
+# ---------------------------
+# text replies (counts / options)
+# ---------------------------
+async def deliver_chunks(chat_id, kind: str, chunks: List[List[Tuple[str,str]]], names: List[str],
+                         zip_name: str, cache_key: tuple):
+    builder = build_vcf_chunk if kind == "vcf" else build_txt_chunk
+    workdir = tempfile.mkdtemp(prefix="vcfbot_split_")
+    try:
+        files = [(os.path.join(workdir, f"{i}.{kind}"), core._with_suffix(name, "." + kind))
+                 for i, name in enumerate(names)]
+        await asyncio.gather(*(cpu(builder, chunk, path) for chunk, (path, _) in zip(chunks, files)))
+        if len(files) > ZIP_THRESHOLD:
+            archives = await cpu(bundle_zip, files, os.path.join(workdir, "bundle"), ZIP_LEVEL, ZIP_MAX_BYTES)
+            stem = Path(zip_name).stem
+            files = [(a, f"{stem}.zip" if len(archives) == 1 else f"{stem}_part{i + 1}.zip")
+                     for i, a in enumerate(archives)]
+        file_ids = []
+        for path, name in files:
+            sent = await send_path(chat_id, path, name)
+            if sent is not None and getattr(sent, "document", None):
+                file_ids.append(sent.document.file_id)
+        if len(file_ids) == len(files):
+            await io(get_conversion_cache().put, file_ids, *cache_key)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+@abot.message_handler(content_types=['text'])
+async def handle_text(msg):
+    if not await io(is_allowed, msg.from_user.id):
+        return
+    sess = await io(user_sessions.get, msg.chat.id, {})
+    if sess.get('flow') in ('split_vcf_wait_count', 'split_txt_wait_count',
+                            'txt2vcf_wait_options', 'xlsx2vcf_wait_options'):
+        submit_job(msg.chat.id, _text_job(msg.chat.id, sess, msg.text.strip()))
+
+async def _text_job(chat_id, sess: dict, text: str):
+    flow = sess['flow']
+    contacts = await io(user_sessions.contacts, chat_id)
+    # the stem names split outputs, so it is part of what the upload looked like
+    cache_key = ("out", sess.get('source'), flow, sess.get('dedup'), sess.get('stem'), text)
+    if flow.endswith('_count'):
+        per_file = int(text) if text.isdigit() else 0
+        if per_file <= 0:
+            await send_message(chat_id, "Please send a positive integer."); return
+        stem = sess.get('stem') or "split"
+        kind = "vcf" if flow == 'split_vcf_wait_count' else "txt"
+        zip_name = f"{stem}_split.zip"
+    else:
+        parts = [p.strip() for p in text.split(",")]
+        per_file = len(contacts) if parts[0].lower() == "single" else (int(parts[0]) if parts[0].isdigit() else 0)
+        if per_file <= 0:
+            await send_message(chat_id, "Options: <contacts_per_vcf>,<vcf_prefix>,<contact_name_prefix> OR single,<vcf_prefix>,<contact_name_prefix>"); return
+        vcf_prefix = parts[1] if len(parts) > 1 else ""
+        name_prefix = parts[2] if len(parts) > 2 else ""
+        if name_prefix:
+            contacts = [(n, p) for n, (_, p) in zip(generate_sequence_from_template(name_prefix, len(contacts)), contacts)]
+        kind = "vcf"
+        zip_name = f"{vcf_prefix.split()[0] if vcf_prefix else 'contacts'}.zip"
+    file_ids = await io(get_conversion_cache().get, *cache_key)
+    if file_ids:
+        for file_id in file_ids:
+            await call(chat_id, abot.send_document, chat_id, file_id)
+    else:
+        chunks = [contacts[i:i + per_file] for i in range(0, len(contacts), per_file)]
+        names = [f"{stem}_{i + 1}" for i in range(len(chunks))] if flow.endswith('_count') \
+            else generate_sequence_from_template(vcf_prefix, len(chunks))
+        await deliver_chunks(chat_id, kind, chunks, names, zip_name, cache_key)
+    await io(user_sessions.pop, chat_id, None)
+
+async def _serve():
+    # the first ACL lookup opens the access DB (and may migrate the legacy
+    # JSON file); do it on a thread before any handler asks
+    await io(get_owner_id)
+    await abot.infinity_polling(skip_pending=True)
+
+def main():
+    core.mark_startup("async init")
+    print(core.startup_report())
+    core.start_prewarm()
+    print("Async bot polling...")
+    asyncio.run(_serve())
+
+if __name__ == "__main__":
+    main()
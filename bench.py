@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Offline micro-benchmarks for the bot's parsing paths (no Telegram connection needed).
+
+Usage:
+  python bench.py txt --lines 1000000
+  python bench.py suite --sizes 10000,100000,1000000 --out bench-$(git rev-parse --short HEAD).json
+  python bench.py compare bench-old.json bench-new.json
+  python bench.py replay updates.jsonl --url http://127.0.0.1:5000/webhook --secret <WEBHOOK_SECRET>
+"""
+
+import os
+import re
+import io
+import json
+import sys
+import time
+import random
+import platform
+import resource
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+
+import requests
+
+import botcore
+
+def _legacy_parse_txt(text):
+    # per-line implementation parse_txt_contacts replaced, kept for comparison
+    out=[]
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        parts = re.split(r"[,\t\|:]+", line)
+        if len(parts) == 1:
+            phone = re.sub(r"[^\d\+]", "", parts[0])
+            name = phone
+        else:
+            phone = None
+            for p in parts[::-1]:
+                if re.search(r"\d", p):
+                    phone = re.sub(r"[^\d\+]", "", p)
+                    break
+            name_parts = [p.strip() for p in parts if p.strip() and re.sub(r"[^\d\+]", "", p) != phone]
+            name = name_parts[0] if name_parts else phone
+        if phone:
+            out.append((name, phone))
+    return out
+
+_NAMES = ["Asha", "Ravi Kumar", "Zoë", "Иван", "李雷", "محمد", "O'Neil"]
+
+def synth_txt(lines: int, seed: int = 1) -> str:
+    rnd = random.Random(seed)
+    seps = [",", "\t", "|", ":", ", "]
+    names = _NAMES
+    rows = []
+    for i in range(lines):
+        phone = f"+91 {rnd.randrange(10**9, 10**10)}" if i % 3 else f"0{rnd.randrange(10**9, 10**10)}"
+        if i % 5 == 0:
+            rows.append(phone)
+        else:
+            rows.append(f"{rnd.choice(names)} {i}{rnd.choice(seps)}{phone}")
+    return "\n".join(rows)
+
+def _rate(fn, text, lines):
+    t0 = time.perf_counter()
+    n = len(fn(text))
+    dt = time.perf_counter() - t0
+    return n, dt, lines / dt
+
+def bench_txt(args):
+    text = synth_txt(args.lines)
+    for label, fn in (("parse_txt_contacts", botcore.parse_txt_contacts),
+                      ("parse_txt_contacts (E.164)", lambda t: botcore.parse_txt_contacts(t, "91")),
+                      ("legacy per-line regex", _legacy_parse_txt)):
+        n, dt, rate = _rate(fn, text, args.lines)
+        print(f"{label:28s} {n:>9d} contacts  {dt:7.2f}s  {rate:>12,.0f} lines/s")
+
+def synth_vcf(cards: int, seed: int = 1) -> bytes:
+    # vCard 2.1/3.0 mix: typed TELs, QP-less folded FN, the odd multi-number card
+    rnd = random.Random(seed)
+    out = []
+    for i in range(cards):
+        name = f"{rnd.choice(_NAMES)} {i}"
+        version = "3.0" if i % 2 else "2.1"
+        out.append(f"BEGIN:VCARD\r\nVERSION:{version}\r\n")
+        out.append(f"FN:{name}\r\n" if i % 7 else f"FN:{name[:3]}\r\n {name[3:]}\r\n")
+        tel = "TEL;TYPE=CELL:" if version == "3.0" else "TEL;CELL:"
+        out.append(f"{tel}+91 {rnd.randrange(10**9, 10**10)}\r\n")
+        if i % 11 == 0:
+            out.append(f"TEL;HOME:0{rnd.randrange(10**9, 10**10)}\r\n")
+        out.append("END:VCARD\r\n")
+    return "".join(out).encode("utf-8")
+
+def synth_xlsx(rows: int, seed: int = 1) -> bytes:
+    import openpyxl
+    rnd = random.Random(seed)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("contacts")
+    ws.append(["Name", "Phone", "City"])
+    for i in range(rows):
+        phone = f"+91 {rnd.randrange(10**9, 10**10)}" if i % 4 else rnd.randrange(10**9, 10**10)
+        ws.append([f"{rnd.choice(_NAMES)} {i}", phone, "Pune"])
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+# case -> (input kind, callable taking the loaded input and the size)
+CASES = {
+    "parse_txt_contacts": ("txt", lambda data, n: botcore.parse_txt_contacts(data)),
+    "parse_vcf_to_contacts": ("vcf", lambda data, n: botcore.parse_vcf_to_contacts(data)),
+    "parse_xlsx_contacts_bytes": ("xlsx", lambda data, n: botcore.parse_xlsx_contacts_bytes(data)),
+    "make_vcf_bytes": ("contacts", lambda data, n: botcore.make_vcf_bytes(data)),
+    "generate_sequence_from_template": (None, lambda data, n: botcore.generate_sequence_from_template("A1D.vcf", n)),
+}
+_SYNTH = {"txt": lambda n: synth_txt(n).encode("utf-8"), "vcf": synth_vcf, "xlsx": synth_xlsx}
+
+def _input_path(data_dir, kind, size):
+    # synthetic inputs are generated once per (kind, size) and reused across revisions
+    path = os.path.join(data_dir, f"{kind}_{size}.{kind}")
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        with open(path + ".tmp", "wb") as fh:
+            fh.write(_SYNTH[kind](size))
+        os.replace(path + ".tmp", path)
+    return path
+
+def _load_input(kind, size, data_dir):
+    if kind is None:
+        return None
+    if kind == "contacts":
+        with open(_input_path(data_dir, "txt", size), "rb") as fh:
+            return botcore.parse_txt_contacts(fh.read())
+    with open(_input_path(data_dir, kind, size), "rb") as fh:
+        return fh.read()
+
+def _reset_peak_rss():
+    # ru_maxrss survives fork+exec, so a case would inherit the suite parent's
+    # peak; on Linux writing 5 to clear_refs resets VmHWM to the current RSS
+    try:
+        with open("/proc/self/clear_refs", "w") as fh:
+            fh.write("5")
+    except OSError:
+        pass
+
+def _max_rss_kb():
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # elsewhere fall back to ru_maxrss: KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+def bench_case(args):
+    # runs in its own interpreter so peak RSS belongs to this case alone
+    kind, fn = CASES[args.case]
+    _reset_peak_rss()
+    data = _load_input(kind, args.size, args.data_dir)
+    input_rss = _max_rss_kb()
+    times, n = [], 0
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        res = fn(data, args.size)
+        times.append(time.perf_counter() - t0)
+        n = len(data) if kind == "contacts" else len(res)   # make_vcf_bytes returns bytes
+        del res
+    best = min(times)
+    print(json.dumps({"case": args.case, "size": args.size, "items": n, "seconds": best,
+                      "runs": times, "items_per_sec": n / best if best else None,
+                      "input_rss_kb": input_rss, "peak_rss_kb": _max_rss_kb()}))
+
+def _revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def bench_suite(args):
+    sizes = [int(x) for x in args.sizes.split(",")]
+    cases = args.cases.split(",") if args.cases else list(CASES)
+    env = dict(os.environ, CPU_WORKERS="0")
+    results = []
+    for case in cases:
+        for size in sizes:
+            kind = CASES[case][0]
+            if kind:   # generate outside the timed subprocess
+                _input_path(args.data_dir, "txt" if kind == "contacts" else kind, size)
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__), "case", case, str(size),
+                                   "--repeat", str(args.repeat), "--data-dir", args.data_dir],
+                                  capture_output=True, text=True, env=env)
+            if proc.returncode:
+                print(f"{case} @ {size}: failed\n{proc.stderr}", file=sys.stderr)
+                continue
+            r = json.loads(proc.stdout.strip().splitlines()[-1])
+            results.append(r)
+            print(f"{case:32s} {size:>9d}  {r['seconds']:8.3f}s  {r['items_per_sec'] or 0:>12,.0f}/s  "
+                  f"peak {r['peak_rss_kb'] / 1024:7.1f} MiB")
+    report = {"revision": _revision(), "python": platform.python_version(), "platform": platform.platform(),
+              "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "repeat": args.repeat, "results": results}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"wrote {args.out}")
+
+def bench_compare(args):
+    def load(path):
+        with open(path, encoding="utf-8") as fh:
+            rep = json.load(fh)
+        return rep, {(r["case"], r["size"]): r for r in rep["results"]}
+    (ra, a), (rb, b) = load(args.old), load(args.new)
+    print(f"{ra.get('revision')} -> {rb.get('revision')}")
+    for key in sorted(a.keys() & b.keys()):
+        old, new = a[key], b[key]
+        dt = (new["seconds"] - old["seconds"]) / old["seconds"] * 100 if old["seconds"] else 0.0
+        drss = (new["peak_rss_kb"] - old["peak_rss_kb"]) / 1024
+        flag = "  <-- slower" if dt > args.threshold else ""
+        print(f"{key[0]:32s} {key[1]:>9d}  {old['seconds']:8.3f}s -> {new['seconds']:8.3f}s  "
+              f"{dt:+6.1f}%  rss {drss:+7.1f} MiB{flag}")
+
+def bench_replay(args):
+    # POST recorded Update JSON (one per line) at a running BOT_MODE=webhook instance
+    with open(args.file, encoding="utf-8") as fh:
+        updates = [json.loads(line) for line in fh if line.strip()]
+    payloads = updates * args.repeat
+    session = requests.Session()
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret}
+    def post(u):
+        t0 = time.perf_counter()
+        r = session.post(args.url, json=u, headers=headers, timeout=30)
+        return r.status_code, time.perf_counter() - t0
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        results = list(pool.map(post, payloads))
+    dt = time.perf_counter() - t0
+    lat = sorted(l for _, l in results)
+    codes = Counter(c for c, _ in results)
+    print(f"{len(results)} updates in {dt:.2f}s  {len(results) / dt:,.0f} req/s  "
+          f"p50 {lat[len(lat) // 2] * 1000:.1f}ms  p99 {lat[min(len(lat) - 1, int(len(lat) * 0.99))] * 1000:.1f}ms  {dict(codes)}")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("txt", help="TXT line parsing throughput")
+    p.add_argument("--lines", type=int, default=1_000_000)
+    p.set_defaults(func=bench_txt)
+    p = sub.add_parser("replay", help="load-test the webhook endpoint with recorded updates")
+    p.add_argument("file", help="JSON lines file, one Telegram Update per line")
+    p.add_argument("--url", default="http://127.0.0.1:5000/webhook")
+    p.add_argument("--secret", default="")
+    p.add_argument("--concurrency", type=int, default=16)
+    p.add_argument("--repeat", type=int, default=10)
+    p.set_defaults(func=bench_replay)
+    p = sub.add_parser("suite", help="time parse/convert/sequence paths on synthetic inputs, write JSON")
+    p.add_argument("--sizes", default="10000,100000,1000000", help="comma-separated contact counts")
+    p.add_argument("--cases", default="", help=f"comma-separated subset of: {', '.join(CASES)}")
+    p.add_argument("--repeat", type=int, default=3, help="runs per case; the best is reported")
+    p.add_argument("--data-dir", default=".bench_data", help="where generated inputs are cached")
+    p.add_argument("--out", default="bench.json")
+    p.set_defaults(func=bench_suite)
+    p = sub.add_parser("case", help="run a single case in this process (used by suite)")
+    p.add_argument("case", choices=list(CASES))
+    p.add_argument("size", type=int)
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--data-dir", default=".bench_data")
+    p.set_defaults(func=bench_case)
+    p = sub.add_parser("compare", help="diff two suite JSON reports")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=10.0, help="percent slowdown to flag")
+    p.set_defaults(func=bench_compare)
+    args = ap.parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
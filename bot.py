@@ -1,11 +1,12 @@
 #!/usr/bin/env python3
 """
-Full-featured Telegram bot (single file) ready for Replit + UptimeRobot 24/7 hosting.
+Full-featured Telegram bot ready for Replit + UptimeRobot 24/7 hosting.
 
-Replace BOT_TOKEN and OWNER_ID below OR set environment variables BOT_TOKEN and OWNER_ID in Replit.
+Replace BOT_TOKEN and OWNER_ID in botcore.py OR set environment variables BOT_TOKEN and OWNER_ID in Replit.
+Config, storage and parsing live in botcore.py; this file holds the TeleBot handlers and entry points.
 
 Features:
-- TinyDB persistent user storage (users_db.json)
+- SQLite persistent user storage (access.db, migrated once from a legacy users_db.json)
 - Admin / Owner system with admin key (default 000000)
 - /help
 - TXT -> VCF (split, filename/contact name templates, auto-sequence)
@@ -15,249 +16,653 @@ Features:
 - Split VCF / TXT
 - Admin + Neavy interactive flow
 - Web endpoint (Flask) for uptime pings (keeps Replit alive with UptimeRobot)
+- Optional webhook mode (BOT_MODE=webhook) served by the same Flask app
+- Optional asyncio entry point (async_bot.py) built on AsyncTeleBot
+- Prometheus /metrics endpoint with per-stage timings, admin /profile (cProfile) reports
+- Multi-process mode (BOT_PROCESSES=N): one ingest process, N workers sharded by chat_id
 """
 
+import time
 import os
 import io
-import re
 import sys
-import zipfile
+import itertools
+import tempfile
 import traceback
 import threading
+import cProfile
+import pstats
+import queue
+import hmac
+import secrets
+import heapq
+import json
+import shutil
+import sqlite3
+import subprocess
+import signal
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import List, Tuple
+from typing import Iterator, List, Tuple
 
+from botcore import (
+    startup_phases, mark_startup, startup_report, BOT_TOKEN, ADMIN_KEY, DOWNLOAD_CHUNK,
+    DEFAULT_COUNTRY_CODE, OUTBOX_WORKERS, OUTBOX_GLOBAL_RATE, OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST,
+    OUTBOX_MAX_RETRIES, IO_WORKERS, CPU_WORKERS, CPU_TIMEOUT, PER_USER_JOBS, MAX_QUEUED_JOBS,
+    JOB_MAX_ATTEMPTS, ZIP_THRESHOLD, ZIP_LEVEL, ZIP_MAX_BYTES, WEB_PORT, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH,
+    WEBHOOK_SECRET, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, BOT_PROCESSES, UPDATE_DB, UPDATE_KEEP_ACKED,
+    OUTBOX_PROGRESS_EVERY, METRICS_DIR, METRICS_FLUSH,
+    wal_connection, acl_cache_stats, acl_cache_hit_rate, get_owner_id, add_user_ids, remove_user_id,
+    add_admin_id, remove_admin_id, parse_user_ids, merge_metrics, metrics, TokenBucket, is_owner, is_admin,
+    is_allowed, UploadTooLarge, check_download_size, parse_txt_contacts, parse_vcf_to_contacts,
+    parse_sheet_contacts, generate_sequence_from_template, parse_dedup_mode, dedup_note, SessionQuotaExceeded,
+    get_session_store, get_conversion_cache, user_sessions, merge_vcf_store, merge_txt_store, CpuTimeout,
+    terminate_pool, _temp_path, vcf_to_txt_file, merge_vcf_file, merge_txt_file, parse_and_dedup,
+    build_vcf_chunk, build_txt_chunk, bundle_zip, _with_suffix, HELP_TEXT, start_prewarm, wait_prewarm,
+)
+
+import requests
 import telebot
-from telebot.types import InputFile
+from telebot import apihelper
+from telebot.apihelper import ApiTelegramException, ApiHTTPException
 
-import pandas as pd
-from tinydb import TinyDB, Query
-from flask import Flask, jsonify
+from flask import Flask, jsonify, request, abort
 
-# ---------------------------
-# CONFIG - Replace / Env Var
-# ---------------------------
-BOT_TOKEN = os.getenv("8421126137:AAE3lsRd6DS4lRZ_bqGGGi3uvEDq9vUwkvw") or "REPLACE_WITH_YOUR_BOT_TOKEN"
-OWNER_ID = int(os.getenv("6497509361") or "123456789")  # replace with your numeric id if not using env
-ADMIN_KEY = os.getenv("ADMIN_KEY") or "000000"
-
-# Replit port (UptimeRobot uses this)
-WEB_PORT = int(os.getenv("PORT", 5000))
+mark_startup("imports")
 
 # ---------------------------
 # Initialization
 # ---------------------------
 bot = telebot.TeleBot(BOT_TOKEN)
 app = Flask("bot_keepalive")
-
-DB_FILE = "users_db.json"
-db = TinyDB(DB_FILE)
-table = db.table("access")  # stores records: {"role": "owner"/"admin"/"user", "id": <int>}
-
-# Ensure owner recorded
-if not table.search((Query().role == "owner") & (Query().id == OWNER_ID)):
-    table.insert({"role": "owner", "id": OWNER_ID})
+session_store = get_session_store()
+conversion_cache = get_conversion_cache()
 
 # ---------------------------
-# DB helper functions
+# outbound rate limiting
 # ---------------------------
-def get_owner_id() -> int:
-    res = table.search(Query().role == "owner")
-    return res[0]["id"] if res else OWNER_ID
+# Every send goes through the outbox: a global and a per-chat token bucket
+# pace calls, chats are served concurrently (FIFO within a chat), 429
+# flood-waits are honoured, and progress acks are coalesced into one
+# edited message.
+class Outbox:
+    def __init__(self, workers: int, global_rate: float, chat_rate: float, chat_burst: float, max_retries: int,
+                 progress_every: float):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.progress_every = progress_every
+        self._global = TokenBucket(global_rate, global_rate)
+        self._buckets = {}      # chat_id -> TokenBucket
+        self._pending = {}      # chat_id -> deque of (fn, args, kwargs, future, pace); pace "chat", "global" or None
+        self._scheduled = set()
+        self._ready = deque()
+        self._delayed = []      # heap of (due, seq, chat_id)
+        self._seq = itertools.count()
+        self._progress = {}     # (chat_id, key) -> {"message_id", "text", "pending", "sent_at"}
+        self._progress_due = []  # heap of (due, seq, chat_id, key): flushes held back by progress_every
+        self._cv = threading.Condition()
+        self.stats = {"sent": 0, "retries": 0, "coalesced": 0}
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"outbox-{i}", daemon=True).start()
 
-def get_admin_ids() -> List[int]:
-    return [r["id"] for r in table.search(Query().role == "admin")]
+    def call(self, chat_id, fn, *args, **kwargs) -> Future:
+        return self._enqueue(chat_id, fn, args, kwargs, "chat")
 
-def get_user_ids() -> List[int]:
-    return [r["id"] for r in table.search(Query().role == "user")]
+    def _enqueue(self, chat_id, fn, args, kwargs, pace) -> Future:
+        fut = Future()
+        with self._cv:
+            self._pending.setdefault(chat_id, deque()).append((fn, args, kwargs, fut, pace))
+            if chat_id not in self._scheduled:
+                self._scheduled.add(chat_id)
+                self._ready.append(chat_id)
+                self._cv.notify()
+        return fut
 
-def get_allowed_ids() -> List[int]:
-    owner = get_owner_id()
-    admins = set(get_admin_ids())
-    users = set(get_user_ids())
-    return list({owner} | admins | users)
+    def depth(self) -> int:
+        with self._cv:
+            return sum(len(q) for q in self._pending.values())
 
-def add_user_id(uid: int):
-    if not table.search((Query().role == "user") & (Query().id == uid)):
-        table.insert({"role": "user", "id": uid})
+    # -- progress messages
+    # Acks are coalesced into one edited message. The edits only take a global
+    # token, so they don't eat the chat's upload budget, and each message is
+    # edited at most once per progress_every seconds.
+    def progress(self, chat_id, key: str, text: str):
+        with self._cv:
+            st = self._progress.setdefault((chat_id, key), {"message_id": None, "text": None, "pending": False,
+                                                            "sent_at": 0.0})
+            st["text"] = text
+            if st["pending"]:
+                self.stats["coalesced"] += 1
+                return
+            st["pending"] = True
+            due = st["sent_at"] + self.progress_every
+            if due > time.monotonic():
+                heapq.heappush(self._progress_due, (due, next(self._seq), chat_id, key))
+                self._cv.notify()
+                return
+        self._enqueue(chat_id, self._flush_progress, (chat_id, key), {}, "global")
 
-def remove_user_id(uid: int):
-    table.remove((Query().role == "user") & (Query().id == uid))
+    def end_progress(self, chat_id, key: str):
+        # queued behind the chat's pending flushes; sends a held-back last ack
+        self._enqueue(chat_id, self._drop_progress, (chat_id, key), {}, "global")
 
-def add_admin_id(uid: int):
-    if not table.search((Query().role == "admin") & (Query().id == uid)):
-        table.insert({"role":"admin","id":uid})
+    def _drop_progress(self, chat_id, key: str):
+        with self._cv:
+            st = self._progress.pop((chat_id, key), None)
+        if st is not None and st["pending"]:
+            self._edit_progress(chat_id, st)
 
-def remove_admin_id(uid: int):
-    table.remove((Query().role == "admin") & (Query().id == uid))
+    def _flush_progress(self, chat_id, key: str):
+        with self._cv:
+            st = self._progress.get((chat_id, key))
+            if st is None or not st["pending"]:
+                return
+        self._edit_progress(chat_id, st)
 
-# ---------------------------
-# Utility functions
-# ---------------------------
-def is_owner(uid:int) -> bool:
-    return uid == get_owner_id()
+    def _edit_progress(self, chat_id, st: dict):
+        with self._cv:
+            st["pending"] = False
+            st["sent_at"] = time.monotonic()
+            text, message_id = st["text"], st["message_id"]
+        if message_id is None:
+            st["message_id"] = bot.send_message(chat_id, text).message_id
+            return
+        try:
+            bot.edit_message_text(text, chat_id, message_id)
+        except ApiTelegramException as e:
+            if "not modified" not in str(e.description).lower():
+                raise
 
-def is_admin(uid:int) -> bool:
-    return uid in get_admin_ids() or is_owner(uid)
+    # -- workers
+    def _next_chat(self):
+        with self._cv:
+            while True:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    self._ready.append(heapq.heappop(self._delayed)[2])
+                while self._progress_due and self._progress_due[0][0] <= now:
+                    _, _, chat_id, key = heapq.heappop(self._progress_due)
+                    self._enqueue(chat_id, self._flush_progress, (chat_id, key), {}, "global")
+                if self._ready:
+                    return self._ready.popleft()
+                due = [h[0][0] for h in (self._delayed, self._progress_due) if h]
+                self._cv.wait(min(due) - now if due else None)
 
-def is_allowed(uid:int) -> bool:
-    return uid in get_allowed_ids() or is_admin(uid) or is_owner(uid)
+    def _bucket(self, chat_id) -> TokenBucket:
+        with self._cv:
+            b = self._buckets.get(chat_id)
+            if b is None:
+                b = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            return b
 
-def deny(chat_id):
-    bot.send_message(chat_id, "Purchase access from @random_0988")
+    def _worker(self):
+        while True:
+            chat_id = self._next_chat()
+            with self._cv:
+                pace = self._pending[chat_id][0][4]
+            if pace == "chat":
+                bucket = self._bucket(chat_id)
+                wait = bucket.delay()
+                if wait > 0:
+                    # park the chat instead of holding a worker while it refills
+                    with self._cv:
+                        heapq.heappush(self._delayed, (time.monotonic() + wait, next(self._seq), chat_id))
+                        self._cv.notify()
+                    continue
+                bucket.consume()
+            if pace:
+                self._global.acquire()
+            with self._cv:
+                fn, args, kwargs, fut, _ = self._pending[chat_id].popleft()
+            if fut.set_running_or_notify_cancel():
+                try:
+                    fut.set_result(self._send(fn, args, kwargs) if pace else fn(*args, **kwargs))
+                except BaseException as e:
+                    fut.set_exception(e)
+            with self._cv:
+                if self._pending[chat_id]:
+                    self._ready.append(chat_id)
+                    self._cv.notify()
+                else:
+                    del self._pending[chat_id]
+                    self._scheduled.discard(chat_id)
+                    if len(self._buckets) > 10000:
+                        self._buckets = {c: b for c, b in self._buckets.items() if c in self._scheduled}
 
-def normalize_phone(ph: str) -> str:
-    ph = str(ph or "").strip()
-    return re.sub(r"[^\d\+]", "", ph)
+    def _send(self, fn, args, kwargs):
+        for attempt in itertools.count():
+            try:
+                res = fn(*args, **kwargs)
+                self.stats["sent"] += 1
+                return res
+            except ApiTelegramException as e:
+                if e.error_code != 429 or attempt >= self.max_retries:
+                    raise
+                retry_after = (e.result_json or {}).get("parameters", {}).get("retry_after", 1)
+                self.stats["retries"] += 1
+                time.sleep(retry_after)
 
-def vcard_entry(name: str, phone: str) -> str:
-    return f"BEGIN:VCARD\r\nVERSION:3.0\r\nN:{name};;;;\r\nFN:{name}\r\nTEL;TYPE=CELL:{phone}\r\nEND:VCARD\r\n"
+outbox = Outbox(OUTBOX_WORKERS, OUTBOX_GLOBAL_RATE, OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST, OUTBOX_MAX_RETRIES,
+                OUTBOX_PROGRESS_EVERY)
 
-def make_vcf_bytes(contacts: List[Tuple[str,str]]) -> bytes:
-    s = "".join(vcard_entry(n,p) for n,p in contacts)
-    return s.encode("utf-8")
+def _log_failure(fut: Future):
+    if fut.exception() is not None:
+        print(f"send failed: {fut.exception()}", file=sys.stderr)
 
-def parse_txt_contacts(text: str) -> List[Tuple[str,str]]:
-    out=[]
-    for raw in text.splitlines():
-        line = raw.strip()
-        if not line:
-            continue
-        parts = re.split(r"[,\t\|:]+", line)
-        if len(parts) == 1:
-            phone = normalize_phone(parts[0])
-            name = phone
-        else:
-            phone = None
-            for p in parts[::-1]:
-                if re.search(r"\d", p):
-                    phone = normalize_phone(p)
-                    break
-            name_parts = [p.strip() for p in parts if p.strip() and normalize_phone(p) != phone]
-            name = name_parts[0] if name_parts else phone
-        if phone:
-            out.append((name, phone))
-    return out
-
-def parse_vcf_to_contacts(b: bytes) -> List[Tuple[str,str]]:
-    txt = b.decode("utf-8", errors="ignore")
-    entries = re.split(r"END:VCARD", txt, flags=re.IGNORECASE)
-    contacts=[]
-    for ent in entries:
-        if not ent.strip(): continue
-        m_tel = re.search(r"TEL[^:]*:([+\d\-\s\(\)]+)", ent, flags=re.IGNORECASE)
-        m_fn = re.search(r"FN:(.+)", ent, flags=re.IGNORECASE)
-        tel = normalize_phone(m_tel.group(1)) if m_tel else None
-        fn = m_fn.group(1).strip() if m_fn else tel
-        if tel:
-            contacts.append((fn, tel))
-    return contacts
-
-def parse_xlsx_contacts_bytes(b: bytes) -> List[Tuple[str,str]]:
-    df = pd.read_excel(io.BytesIO(b), engine="openpyxl")
-    phone_col = None
-    name_col = None
-    for c in df.columns:
-        lc = str(c).lower()
-        if any(k in lc for k in ("phone","tel","mobile","number","contact")) and phone_col is None:
-            phone_col = c
-        if any(k in lc for k in ("name","fullname","contact","姓名")) and name_col is None:
-            name_col = c
-    if phone_col is None:
-        for c in df.columns:
-            if df[c].dropna().apply(lambda x: bool(re.search(r"\d", str(x)))).sum() > 0:
-                phone_col = c; break
-    if name_col is None:
-        for c in df.columns:
-            if c != phone_col:
-                name_col = c; break
-    contacts=[]
-    if phone_col is None:
-        return contacts
-    for _, row in df.iterrows():
-        phone = normalize_phone(row[phone_col]) if not pd.isna(row[phone_col]) else None
-        if not phone: continue
-        name = row[name_col] if (name_col is not None and not pd.isna(row[name_col])) else phone
-        contacts.append((str(name).strip(), phone))
-    return contacts
+def send_message(chat_id, text, **kwargs) -> Future:
+    fut = outbox.call(chat_id, lambda: bot.send_message(chat_id, text, **kwargs))
+    fut.add_done_callback(_log_failure)
+    return fut
+
+def send_document(chat_id, document, **kwargs) -> Future:
+    fut = outbox.call(chat_id, lambda: bot.send_document(chat_id, document, **kwargs))
+    fut.add_done_callback(_log_failure)
+    return fut
 
 # ---------------------------
-# sequence utilities (A2D -> A3D)
+# Utility functions
 # ---------------------------
-def detect_sequence_template(s: str):
-    m = re.search(r"(\d+)", s)
-    if not m:
-        return None
-    return (s[:m.start()], int(m.group(1)), s[m.end():])
-
-def generate_sequence_from_template(template: str, count: int):
-    template = (template or "").strip()
-    if not template:
-        return [f"file{i+1}.vcf" for i in range(count)]
-    if " " in template:
-        parts = [p.strip() for p in template.split() if p.strip()]
-        if len(parts) >= count:
-            return parts[:count]
-        last = parts[-1]
-        tpl = detect_sequence_template(last)
-        seq = parts[:]
-        if tpl:
-            prefix, num, suffix = tpl
-            while len(seq) < count:
-                num += 1
-                seq.append(f"{prefix}{num}{suffix}")
-            return seq
-        while len(seq) < count:
-            seq.append(parts[-1])
-        return seq
-    tpl = detect_sequence_template(template)
-    seq=[]
-    if tpl:
-        prefix,num,suffix = tpl
-        for i in range(count):
-            seq.append(f"{prefix}{num + i}{suffix}")
-        return seq
+def deny(chat_id):
+    send_message(chat_id, "Purchase access from @random_0988")
+
+_download_local = threading.local()
+
+def _download_session() -> requests.Session:
+    # one keep-alive session per downloading thread, owned here rather than telebot's
+    sess = getattr(_download_local, "session", None)
+    if sess is None:
+        sess = _download_local.session = requests.Session()
+    return sess
+
+def download_to_file(file_path: str, suffix: str = "") -> Path:
+    # stream a Telegram file to a temp file in DOWNLOAD_CHUNK pieces instead of
+    # holding the whole body in memory; the size cap is enforced as bytes arrive
+    if apihelper.FILE_URL is None:
+        url = f"https://api.telegram.org/file/bot{bot.token}/{file_path}"
     else:
-        for i in range(1, count+1):
-            seq.append(f"{template}{i}")
-        return seq
+        url = apihelper.FILE_URL.format(bot.token, file_path)
+    path = Path(_temp_path(suffix))
+    try:
+        total = 0
+        with _download_session().get(url, proxies=apihelper.proxy, stream=True,
+                                     timeout=apihelper.READ_TIMEOUT) as resp:
+            if resp.status_code != 200:
+                raise ApiHTTPException('Download file', resp)
+            with open(path, "wb") as out:
+                for chunk in resp.iter_content(DOWNLOAD_CHUNK):
+                    total += len(chunk)
+                    check_download_size(total)
+                    out.write(chunk)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return path
+
+def send_file(chat_id, fh, filename: str, **kwargs):
+    def upload():
+        fh.seek(0)   # a flood-wait retry re-sends from the start
+        return bot.send_document(chat_id, fh, visible_file_name=filename, **kwargs)
+    try:
+        fh.seek(0, os.SEEK_END)
+        metrics.inc("vcfbot_bytes_total", fh.tell(), direction="upload")
+        with metrics.timed("upload"):
+            return outbox.call(chat_id, upload).result()
+    finally:
+        fh.close()
 
 # ---------------------------
-# session & merge storage
+# job scheduler
 # ---------------------------
-user_sessions = {}         # chat_id -> session dict
-merge_vcf_store = {}       # chat_id -> [bytes]
-merge_txt_store = {}       # chat_id -> [str]
+# Handler bodies run as jobs on a bounded I/O thread pool (download, upload);
+# parsing and VCF building are pushed to a process pool via run_cpu.
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    def __init__(self, chat_id, fn, args):
+        self.chat_id = chat_id
+        self.fn = fn
+        self.args = args
+        self.cancelled = threading.Event()
+        self.done = threading.Event()   # set once the job ran or was dropped from the queue
+        self.profile = None
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise JobCancelled()
+
+class JobScheduler:
+    def __init__(self, io_workers: int, cpu_workers: int, per_user: int, max_queued: int):
+        self.io_workers = io_workers
+        self.cpu_workers = cpu_workers
+        self.per_user = per_user
+        self.max_queued = max_queued
+        self._io = ThreadPoolExecutor(io_workers, thread_name_prefix="job-io")
+        self._cpu = None
+        self._lock = threading.Lock()
+        self._queue = deque()
+        self._running = {}   # chat_id -> set of running jobs
+
+    def submit(self, chat_id, fn, *args):
+        # returns (job, position); position 0 = started or waiting on own job, -1 = rejected
+        with self._lock:
+            if len(self._queue) >= self.max_queued:
+                return None, -1
+            job = Job(chat_id, fn, args)
+            self._queue.append(job)
+            self._pump()
+            # only report a position when the pool is full, not when the job
+            # simply waits behind the same chat's previous one
+            if job in self._queue and self._active() >= self.io_workers:
+                return job, self._queue.index(job) + 1
+            return job, 0
+
+    def cancel(self, chat_id) -> int:
+        n = 0
+        with self._lock:
+            for job in [j for j in self._queue if j.chat_id == chat_id]:
+                self._queue.remove(job); job.done.set(); n += 1
+            for job in self._running.get(chat_id, ()):
+                job.cancelled.set(); n += 1
+        return n
+
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def run_cpu(self, job: Job, fn, *args, stage: str = None):
+        job.check()
+        with metrics.timed(stage or fn.__name__):
+            if self.cpu_workers <= 0 or job.profile is not None:
+                # profiled jobs run inline so the parse shows up in the dump
+                return fn(*args)
+            return next(self._pooled(job, fn, [args]))
+
+    def iter_cpu_many(self, job: Job, fn, arg_list: List[tuple]) -> Iterator:
+        # fan independent CPU tasks out over the process pool; each result is
+        # yielded, in order, as soon as it and those before it are done, and
+        # leaving early cancels whatever has not started
+        job.check()
+        if self.cpu_workers <= 0 or job.profile is not None:
+            for args in arg_list:
+                job.check()
+                yield fn(*args)
+            return
+        yield from self._pooled(job, fn, arg_list)
+
+    def _pooled(self, job: Job, fn, arg_list: List[tuple]) -> Iterator:
+        subs = [self._submit(fn, args) for args in arg_list]   # (pool, future) per task
+        try:
+            for i, args in enumerate(arg_list):
+                while True:
+                    pool, fut = subs[i]
+                    try:
+                        result = self._result(job, pool, fut)
+                        break
+                    except BrokenProcessPool:
+                        if pool is self._cpu:
+                            raise
+                        # another job's timeout recycled the pool under us: run
+                        # what it took down again on the new one
+                        for j in range(i, len(subs)):
+                            old_pool, old = subs[j]
+                            if old_pool is pool and not (old.done() and not old.cancelled() and old.exception() is None):
+                                subs[j] = self._submit(fn, arg_list[j])
+                yield result
+        finally:
+            for _, fut in subs:
+                fut.cancel()
+
+    def _submit(self, fn, args: tuple) -> Tuple[ProcessPoolExecutor, Future]:
+        while True:
+            pool = self._cpu_pool()
+            try:
+                return pool, pool.submit(fn, *args)
+            except (BrokenProcessPool, RuntimeError):
+                if pool is self._cpu:   # recycled between the two lines above otherwise
+                    raise
+
+    def _result(self, job: Job, pool: ProcessPoolExecutor, fut: Future):
+        # poll so cancellation is noticed; a task running past CPU_TIMEOUT takes
+        # its pool down with it, otherwise the hung worker would be reused.
+        # The clock starts when the task does, not while it queues behind others
+        deadline = None
+        while True:
+            try:
+                return fut.result(timeout=0.5)
+            except FutureTimeout:
+                if job.cancelled.is_set():
+                    fut.cancel()
+                    raise JobCancelled()
+                if deadline is None and fut.running():
+                    deadline = time.monotonic() + CPU_TIMEOUT
+                if deadline is not None and time.monotonic() > deadline:
+                    self._recycle_cpu_pool(pool)
+                    raise CpuTimeout("Processing took too long and was stopped. Please try a smaller file.")
+
+    def _cpu_pool(self):
+        if self._cpu is None:
+            # never fork while the prewarm thread may hold an import lock (the
+            # child would inherit it locked and hang on its next import); wait
+            # before taking self._lock, which submit() and finishing jobs need
+            wait_prewarm()
+        with self._lock:
+            if self._cpu is None:
+                self._cpu = ProcessPoolExecutor(self.cpu_workers)
+            return self._cpu
+
+    def _recycle_cpu_pool(self, pool: ProcessPoolExecutor):
+        # other jobs' tasks on it fail with BrokenProcessPool and are resubmitted (see _pooled)
+        with self._lock:
+            if self._cpu is not pool:
+                return   # already replaced by another timeout
+            self._cpu = None
+        terminate_pool(pool)
+
+    def _active(self) -> int:
+        return sum(len(v) for v in self._running.values())
+
+    def _pump(self):
+        active = self._active()
+        for job in list(self._queue):
+            if active >= self.io_workers:
+                break
+            if len(self._running.get(job.chat_id, ())) >= self.per_user:
+                continue
+            self._queue.remove(job)
+            self._running.setdefault(job.chat_id, set()).add(job)
+            active += 1
+            self._io.submit(self._run, job)
+
+    def _run(self, job: Job):
+        if job.chat_id in profile_requests:
+            profile_requests.discard(job.chat_id)
+            job.profile = cProfile.Profile()
+        try:
+            job.check()
+            if job.profile is not None:
+                job.profile.runcall(job.fn, job, *job.args)
+            else:
+                job.fn(job, *job.args)
+        except JobCancelled:
+            pass
+        except (SessionQuotaExceeded, UploadTooLarge, CpuTimeout) as e:
+            send_message(job.chat_id, str(e))
+        except Exception:
+            traceback.print_exc()
+            try:
+                send_message(job.chat_id, "Something went wrong while processing your request.")
+            except Exception:
+                pass
+        finally:
+            if job.profile is not None:
+                send_profile(job)
+            job.done.set()
+            with self._lock:
+                running = self._running.get(job.chat_id)
+                if running is not None:
+                    running.discard(job)
+                    if not running:
+                        self._running.pop(job.chat_id, None)
+                self._pump()
+
+scheduler = JobScheduler(IO_WORKERS, CPU_WORKERS, PER_USER_JOBS, MAX_QUEUED_JOBS)
+profile_requests = set()   # chat ids whose next job is run under cProfile (/profile)
+
+def send_profile(job: Job):
+    buf = io.StringIO()
+    pstats.Stats(job.profile, stream=buf).sort_stats("cumulative").print_stats(40)
+    out = io.BytesIO(buf.getvalue().encode("utf-8"))
+    try:
+        send_file(job.chat_id, out, f"profile_{job.fn.__name__.strip('_')}.txt")
+    except Exception:
+        traceback.print_exc()
+
+def submit_job(chat_id, fn, *args):
+    job, pos = scheduler.submit(chat_id, fn, *args)
+    sink = getattr(_update_jobs, "jobs", None)
+    if sink is not None and job is not None:
+        sink.append(job)
+    if pos < 0:
+        send_message(chat_id, "Bot is busy right now, please try again in a minute.")
+    elif pos > 0:
+        send_message(chat_id, f"Busy, you are #{pos} in queue.")
+    return job
+
+def cancel_jobs(chat_id):
+    # a new flow supersedes whatever this chat had queued, running or left
+    # interrupted for /resume
+    scheduler.cancel(chat_id)
+    for job_id, _ in session_store.pending_jobs(chat_id):
+        session_store.finish_job(job_id)
+
+def start_flow(chat_id, flow: str, **extra):
+    cancel_jobs(chat_id)
+    user_sessions[chat_id] = {'flow': flow, **extra}
+
+def send_path(chat_id, path: str, filename: str):
+    try:
+        return send_file(chat_id, open(path, "rb"), filename)
+    finally:
+        os.unlink(path)
+
+def remember_output(key: tuple, sent):
+    # keep the uploaded document's file_id so a repeat request is a resend
+    if sent is not None and getattr(sent, "document", None):
+        conversion_cache.put(sent.document.file_id, *key)
 
 # ---------------------------
-# help text
+# split / bundle engine
 # ---------------------------
-HELP_TEXT = f"""
-📚 Commands & who can use them:
-
-Public / Allowed:
- - /help
- - /txt2vcf     -> interactive: upload TXT doc
- - /xlsx2vcf    -> interactive: upload XLSX
- - /vcf2txt     -> upload VCF -> returns TXT
- - /merge_vcf   -> send many VCF docs then /done_merge
- - /merge_txt   -> send many TXT docs then /done_merge_txt
- - /split_vcf   -> upload VCF then specify per-file count
- - /split_txt   -> upload TXT then specify per-file count
- - /adminneavy  -> interactive Admin+Neavy VCF creator
-
-Admin / Owner:
- - /admin <admin_key>       (owner uses this)
- - /adduser <telegram_user_id>
- - /removeuser <telegram_user_id>  (owner cannot be removed)
- - /addadmin <admin_key> <telegram_user_id>
- - /removeadmin <admin_key> <telegram_user_id>
-
-Notes:
- - Default admin key: {ADMIN_KEY}
- - Unauthorized users see: 'Purchase access from @random_0988'
- - Attempt to remove owner -> 'BAAP SE PANGA NHI 😁'
-"""
+def _chunk(contacts: list, per_file: int) -> List[list]:
+    return [contacts[i:i + per_file] for i in range(0, len(contacts), per_file)]
+
+_live_jobs = set()   # persisted job ids being delivered by this process
+
+def deliver_chunks(job: Job, kind: str, contacts: List[Tuple[str,str]], per_file: int, names: List[str],
+                   zip_name: str, cache_key: tuple = None, resume: tuple = None):
+    # build chunks in parallel and send each output as soon as it is ready
+    # (ZIP mode sends archive by archive); one progress message is edited
+    # throughout and the sent count is persisted so a restart resumes it
+    chat_id = job.chat_id
+    if resume is None:
+        job_id, done, file_ids = secrets.token_hex(8), 0, []
+        session_store.save_job(job_id, chat_id, {"kind": kind, "per_file": per_file, "names": names,
+                                                 "zip_name": zip_name, "cache_key": cache_key}, contacts)
+    else:
+        job_id, done, file_ids = resume
+    chunks = _chunk(contacts, per_file)
+    _live_jobs.add(job_id)
+    builder = build_vcf_chunk if kind == "vcf" else build_txt_chunk
+    workdir = tempfile.mkdtemp(prefix="vcfbot_split_")
+    def report(text):
+        outbox.progress(chat_id, "convert", text)
+    try:
+        files = []
+        for i, (chunk, name) in enumerate(zip(chunks, names)):
+            files.append((os.path.join(workdir, f"{i}.{kind}"), _with_suffix(name, "." + kind), chunk))
+        t0 = time.perf_counter()
+        if len(files) > ZIP_THRESHOLD:
+            built = scheduler.iter_cpu_many(job, builder, [(chunk, path) for path, _, chunk in files])
+            for n, _ in enumerate(built, 1):
+                report(f"Building {kind.upper()} files: {n}/{len(files)}")
+            metrics.observe(builder.__name__, time.perf_counter() - t0)
+            archives = scheduler.run_cpu(job, bundle_zip, [(path, name) for path, name, _ in files],
+                                         os.path.join(workdir, "bundle"), ZIP_LEVEL, ZIP_MAX_BYTES)
+            stem = Path(zip_name).stem
+            outputs = [(a, f"{stem}.zip" if len(archives) == 1 else f"{stem}_part{i + 1}.zip")
+                       for i, a in enumerate(archives)]
+            total, pending = len(outputs), iter(outputs[done:])
+        else:
+            built = scheduler.iter_cpu_many(job, builder, [(chunk, path) for path, _, chunk in files[done:]])
+            total, pending = len(files), ((path, name) for (path, name, _), _ in zip(files[done:], built))
+        for path, name in pending:
+            job.check()
+            report(f"Sending files: {done}/{total} sent")
+            sent = send_file(chat_id, open(path, "rb"), name)
+            done += 1
+            if sent is not None and getattr(sent, "document", None):
+                file_ids.append(sent.document.file_id)
+            session_store.job_progress(job_id, done, file_ids)
+        metrics.record_contacts(builder.__name__, sum(len(c) for c in chunks), time.perf_counter() - t0)
+        report(f"Done: {total} file(s) sent.")
+        if cache_key and len(file_ids) == total:
+            conversion_cache.put(file_ids, *cache_key)
+        session_store.finish_job(job_id)
+        return len(files)
+    except (JobCancelled, CpuTimeout, SessionQuotaExceeded):
+        # cancelled, or a retry would fail the same way; _run reports the error
+        session_store.finish_job(job_id)
+        raise
+    except Exception:
+        # keep the job row: /resume (or the next start) continues after the last sent file
+        traceback.print_exc()
+        report(f"Stopped after {done} sent file(s). Send /resume to continue from there "
+               f"(up to {JOB_MAX_ATTEMPTS} retries).")
+        return done
+    finally:
+        _live_jobs.discard(job_id)
+        outbox.end_progress(chat_id, "convert")
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def _resume_job(job: Job, job_id: str):
+    row = session_store.get_job(job_id)
+    if row is None or job_id in _live_jobs:
+        return
+    _, spec, done, file_ids = row
+    # every resume counts, so a job that keeps failing is dropped instead of
+    # being retried on each start until the TTL expires
+    contacts = session_store.job_contacts(job_id, job.chat_id)
+    if contacts is None or "per_file" not in spec:
+        session_store.finish_job(job_id)
+        send_message(job.chat_id, "Your interrupted conversion expired; please upload the file again."); return
+    if session_store.job_attempt(job_id) > JOB_MAX_ATTEMPTS:
+        session_store.finish_job(job_id)
+        send_message(job.chat_id, f"Your {spec['kind'].upper()} conversion still failed after "
+                                  f"{JOB_MAX_ATTEMPTS} retries ({done} file(s) sent); giving up. Please upload the file again."); return
+    cache_key = tuple(spec["cache_key"]) if spec["cache_key"] else None
+    send_message(job.chat_id, f"Resuming your {spec['kind'].upper()} conversion after {done} sent file(s)...")
+    deliver_chunks(job, spec["kind"], contacts, spec["per_file"], spec["names"], spec["zip_name"], cache_key,
+                   resume=(job_id, done, file_ids))
+
+def resume_jobs(chat_id=None, shard: Tuple[int,int] = None) -> int:
+    # requeue persisted conversions (all chats at startup, one chat for /resume);
+    # a worker process only picks up chats of its own shard
+    jobs = [(job_id, chat) for job_id, chat in session_store.pending_jobs(chat_id)
+            if job_id not in _live_jobs and (shard is None or chat % shard[1] == shard[0])]
+    for job_id, chat in jobs:
+        submit_job(chat, _resume_job, job_id)
+    return len(jobs)
+
+def resend_cached(chat_id, cache_key: tuple) -> bool:
+    file_ids = conversion_cache.get(*cache_key)
+    if not file_ids:
+        return False
+    for file_id in file_ids:
+        send_document(chat_id, file_id)
+    return True
 
 # ---------------------------
 # command handlers
@@ -267,85 +672,100 @@ def handle_help(msg):
     uid = msg.from_user.id
     if not is_allowed(uid):
         deny(msg.chat.id); return
-    bot.send_message(msg.chat.id, HELP_TEXT)
+    send_message(msg.chat.id, HELP_TEXT)
 
 @bot.message_handler(commands=['admin'])
 def handle_admin(msg):
     parts = msg.text.strip().split()
     if len(parts) < 2:
-        bot.send_message(msg.chat.id, "Usage: /admin <admin_key> (owner only)")
+        send_message(msg.chat.id, "Usage: /admin <admin_key> (owner only)")
         return
     key = parts[1]
     if key != ADMIN_KEY:
-        bot.send_message(msg.chat.id, "Invalid admin key.")
+        send_message(msg.chat.id, "Invalid admin key.")
         return
     if not is_owner(msg.from_user.id):
-        bot.send_message(msg.chat.id, "Only owner can activate admin via this.")
+        send_message(msg.chat.id, "Only owner can activate admin via this.")
         return
     add_admin_id(msg.from_user.id)
-    bot.send_message(msg.chat.id, "You are now an admin (owner is always admin).")
+    send_message(msg.chat.id, "You are now an admin (owner is always admin).")
 
 @bot.message_handler(commands=['adduser'])
 def handle_adduser(msg):
     if not is_admin(msg.from_user.id):
-        bot.send_message(msg.chat.id, "Only admin/owner can add users."); return
-    parts = msg.text.strip().split()
-    if len(parts) < 2:
-        bot.send_message(msg.chat.id, "Usage: /adduser <telegram_user_id>"); return
-    try:
-        tid = int(parts[1])
-    except:
-        bot.send_message(msg.chat.id, "telegram_user_id must be a number"); return
-    add_user_id(tid)
-    bot.send_message(msg.chat.id, f"User {tid} added to allowed users.")
+        send_message(msg.chat.id, "Only admin/owner can add users."); return
+    ids, bad = parse_user_ids(msg.text)
+    if bad:
+        send_message(msg.chat.id, f"telegram_user_id must be a number: {' '.join(bad[:10])}"); return
+    if not ids:
+        send_message(msg.chat.id, "Usage: /adduser <telegram_user_id> [more ids...]"); return
+    added = add_user_ids(ids)
+    if len(ids) == 1:
+        send_message(msg.chat.id, f"User {ids[0]} added to allowed users.")
+    else:
+        send_message(msg.chat.id, f"{added} of {len(ids)} users added to allowed users ({len(ids) - added} already present).")
 
 @bot.message_handler(commands=['removeuser'])
 def handle_removeuser(msg):
     if not is_admin(msg.from_user.id):
-        bot.send_message(msg.chat.id, "Only admin/owner can remove users."); return
+        send_message(msg.chat.id, "Only admin/owner can remove users."); return
     parts = msg.text.strip().split()
     if len(parts) < 2:
-        bot.send_message(msg.chat.id, "Usage: /removeuser <telegram_user_id>"); return
+        send_message(msg.chat.id, "Usage: /removeuser <telegram_user_id>"); return
     try:
         tid = int(parts[1])
     except:
-        bot.send_message(msg.chat.id, "telegram_user_id must be a number"); return
+        send_message(msg.chat.id, "telegram_user_id must be a number"); return
     if tid == get_owner_id():
-        bot.send_message(msg.chat.id, "BAAP SE PANGA NHI 😁"); return
+        send_message(msg.chat.id, "BAAP SE PANGA NHI 😁"); return
     remove_user_id(tid)
-    bot.send_message(msg.chat.id, f"User {tid} removed from allowed users.")
+    send_message(msg.chat.id, f"User {tid} removed from allowed users.")
 
 @bot.message_handler(commands=['addadmin'])
 def handle_addadmin(msg):
     parts = msg.text.strip().split()
     if len(parts) < 3:
-        bot.send_message(msg.chat.id, "Usage: /addadmin <admin_key> <telegram_user_id>"); return
+        send_message(msg.chat.id, "Usage: /addadmin <admin_key> <telegram_user_id>"); return
     key = parts[1]
     try:
         tid = int(parts[2])
     except:
-        bot.send_message(msg.chat.id, "telegram_user_id must be a number"); return
+        send_message(msg.chat.id, "telegram_user_id must be a number"); return
     if key != ADMIN_KEY:
-        bot.send_message(msg.chat.id, "Invalid admin key"); return
+        send_message(msg.chat.id, "Invalid admin key"); return
     add_admin_id(tid)
-    bot.send_message(msg.chat.id, f"Added admin {tid}.")
+    send_message(msg.chat.id, f"Added admin {tid}.")
 
 @bot.message_handler(commands=['removeadmin'])
 def handle_removeadmin(msg):
     parts = msg.text.strip().split()
     if len(parts) < 3:
-        bot.send_message(msg.chat.id, "Usage: /removeadmin <admin_key> <telegram_user_id>"); return
+        send_message(msg.chat.id, "Usage: /removeadmin <admin_key> <telegram_user_id>"); return
     key = parts[1]
     try:
         tid = int(parts[2])
     except:
-        bot.send_message(msg.chat.id, "telegram_user_id must be a number"); return
+        send_message(msg.chat.id, "telegram_user_id must be a number"); return
     if key != ADMIN_KEY:
-        bot.send_message(msg.chat.id, "Invalid admin key"); return
+        send_message(msg.chat.id, "Invalid admin key"); return
     if tid == get_owner_id():
-        bot.send_message(msg.chat.id, "BAAP SE PANGA NHI 😁"); return
+        send_message(msg.chat.id, "BAAP SE PANGA NHI 😁"); return
     remove_admin_id(tid)
-    bot.send_message(msg.chat.id, f"Removed admin {tid}.")
+    send_message(msg.chat.id, f"Removed admin {tid}.")
+
+@bot.message_handler(commands=['resume'])
+def handle_resume(msg):
+    if not is_allowed(msg.from_user.id):
+        deny(msg.chat.id); return
+    if not resume_jobs(msg.chat.id):
+        send_message(msg.chat.id, "Nothing to resume.")
+
+@bot.message_handler(commands=['profile'])
+def handle_profile(msg):
+    if not is_admin(msg.from_user.id):
+        send_message(msg.chat.id, "Only admin/owner can profile requests."); return
+    profile_requests.add(msg.chat.id)
+    send_message(msg.chat.id, "Your next request will be profiled; the cProfile report is sent after it finishes.")
 
 # ---------------------------
 # flows start
@@ -354,84 +774,102 @@ def handle_removeadmin(msg):
 def cmd_txt2vcf(msg):
     if not is_allowed(msg.from_user.id):
         deny(msg.chat.id); return
-    user_sessions[msg.chat.id] = {'flow':'txt2vcf_wait_file'}
-    bot.send_message(msg.chat.id, "Send the TXT file as a *document*. Each line: phone OR name,phone OR name<TAB>phone", parse_mode='Markdown')
+    start_flow(msg.chat.id, 'txt2vcf_wait_file', dedup=parse_dedup_mode(msg.text))
+    send_message(msg.chat.id, "Send the TXT file as a *document*. Each line: phone OR name,phone OR name<TAB>phone", parse_mode='Markdown')
 
 @bot.message_handler(commands=['xlsx2vcf'])
 def cmd_xlsx2vcf(msg):
     if not is_allowed(msg.from_user.id):
         deny(msg.chat.id); return
-    user_sessions[msg.chat.id] = {'flow':'xlsx2vcf_wait_file'}
-    bot.send_message(msg.chat.id, "Send the XLSX file as a *document*. Bot will try to detect columns", parse_mode='Markdown')
+    start_flow(msg.chat.id, 'xlsx2vcf_wait_file', dedup=parse_dedup_mode(msg.text))
+    send_message(msg.chat.id, "Send the XLSX (or CSV) file as a *document*. Bot will try to detect columns", parse_mode='Markdown')
 
 @bot.message_handler(commands=['vcf2txt'])
 def cmd_vcf2txt(msg):
     if not is_allowed(msg.from_user.id):
         deny(msg.chat.id); return
-    user_sessions[msg.chat.id] = {'flow':'vcf2txt_wait_file'}
-    bot.send_message(msg.chat.id, "Send the VCF file as a document")
+    start_flow(msg.chat.id, 'vcf2txt_wait_file')
+    send_message(msg.chat.id, "Send the VCF file as a document")
 
 @bot.message_handler(commands=['merge_vcf'])
 def cmd_merge_vcf(msg):
     if not is_allowed(msg.from_user.id):
         deny(msg.chat.id); return
-    merge_vcf_store[msg.chat.id] = []
-    bot.send_message(msg.chat.id, "Send VCF files (documents) one by one. When done send /done_merge")
+    cancel_jobs(msg.chat.id)
+    merge_vcf_store.start(msg.chat.id)
+    outbox.end_progress(msg.chat.id, "merge")
+    send_message(msg.chat.id, "Send VCF files (documents) one by one. When done send /done_merge")
 
 @bot.message_handler(commands=['done_merge'])
 def cmd_done_merge(msg):
     if not is_allowed(msg.from_user.id):
         deny(msg.chat.id); return
-    col = merge_vcf_store.get(msg.chat.id, [])
+    submit_job(msg.chat.id, _done_merge_job, parse_dedup_mode(msg.text))
+
+def _done_merge_job(job: Job, dedup: str = None):
+    chat_id = job.chat_id
+    col = merge_vcf_store.paths(chat_id)
     if not col:
-        bot.send_message(msg.chat.id, "No files collected"); return
-    contacts=[]
-    for b in col:
-        contacts += parse_vcf_to_contacts(b)
-    if not contacts:
-        bot.send_message(msg.chat.id, "No contacts parsed"); merge_vcf_store.pop(msg.chat.id, None); return
-    out = make_vcf_bytes(contacts)
-    bot.send_document(msg.chat.id, InputFile(io.BytesIO(out), filename="merged.vcf"))
-    merge_vcf_store.pop(msg.chat.id, None)
+        send_message(chat_id, "No files collected"); return
+    path = _temp_path(".vcf")
+    count, dropped = scheduler.run_cpu(job, merge_vcf_file, col, path, dedup)
+    merge_vcf_store.pop(chat_id)
+    outbox.end_progress(chat_id, "merge")
+    if not count:
+        os.unlink(path)
+        send_message(chat_id, "No contacts parsed"); return
+    send_path(chat_id, path, "merged.vcf")
+    if dedup:
+        send_message(chat_id, f"Merged {count} contacts" + dedup_note(dropped))
 
 @bot.message_handler(commands=['merge_txt'])
 def cmd_merge_txt(msg):
     if not is_allowed(msg.from_user.id):
         deny(msg.chat.id); return
-    merge_txt_store[msg.chat.id] = []
-    bot.send_message(msg.chat.id, "Send TXT files (documents) one by one. When done send /done_merge_txt")
+    cancel_jobs(msg.chat.id)
+    merge_txt_store.start(msg.chat.id)
+    outbox.end_progress(msg.chat.id, "merge")
+    send_message(msg.chat.id, "Send TXT files (documents) one by one. When done send /done_merge_txt")
 
 @bot.message_handler(commands=['done_merge_txt'])
 def cmd_done_merge_txt(msg):
     if not is_allowed(msg.from_user.id):
         deny(msg.chat.id); return
-    col = merge_txt_store.get(msg.chat.id, [])
+    submit_job(msg.chat.id, _done_merge_txt_job, parse_dedup_mode(msg.text))
+
+def _done_merge_txt_job(job: Job, dedup: str = None):
+    chat_id = job.chat_id
+    col = merge_txt_store.paths(chat_id)
     if not col:
-        bot.send_message(msg.chat.id, "No files collected"); return
-    text = "\n".join(col)
-    bot.send_document(msg.chat.id, InputFile(io.BytesIO(text.encode('utf-8')), filename="merged.txt"))
-    merge_txt_store.pop(msg.chat.id, None)
+        send_message(chat_id, "No files collected"); return
+    path = _temp_path(".txt")
+    _, dropped = scheduler.run_cpu(job, merge_txt_file, col, path, dedup)
+    send_path(chat_id, path, "merged.txt")
+    merge_txt_store.pop(chat_id)
+    outbox.end_progress(chat_id, "merge")
+    if dedup:
+        send_message(chat_id, "Merged TXT files" + dedup_note(dropped))
 
 @bot.message_handler(commands=['split_vcf'])
 def cmd_split_vcf(msg):
     if not is_allowed(msg.from_user.id):
         deny(msg.chat.id); return
-    user_sessions[msg.chat.id] = {'flow':'split_vcf_wait_file'}
-    bot.send_message(msg.chat.id, "Send VCF file as document to split")
+    start_flow(msg.chat.id, 'split_vcf_wait_file', dedup=parse_dedup_mode(msg.text))
+    send_message(msg.chat.id, "Send VCF file as document to split")
 
 @bot.message_handler(commands=['split_txt'])
 def cmd_split_txt(msg):
     if not is_allowed(msg.from_user.id):
         deny(msg.chat.id); return
-    user_sessions[msg.chat.id] = {'flow':'split_txt_wait_file'}
-    bot.send_message(msg.chat.id, "Send TXT file as document to split")
+    start_flow(msg.chat.id, 'split_txt_wait_file', dedup=parse_dedup_mode(msg.text))
+    send_message(msg.chat.id, "Send TXT file as document to split")
 
 @bot.message_handler(commands=['adminneavy'])
 def cmd_adminneavy(msg):
     if not is_allowed(msg.from_user.id):
         deny(msg.chat.id); return
-    user_sessions[msg.chat.id] = {'flow':'adminneavy_wait_admin_number'}
-    bot.send_message(msg.chat.id, "Enter ADMIN number (phone):")
+    start_flow(msg.chat.id, 'adminneavy_wait_admin_number')
+    send_message(msg.chat.id, "Enter ADMIN number (phone):")
 
 # ---------------------------
 # document handler
@@ -440,79 +878,470 @@ def cmd_adminneavy(msg):
 def handle_document(msg):
     if not is_allowed(msg.from_user.id):
         deny(msg.chat.id); return
+    submit_job(msg.chat.id, _document_job, msg)
+
+def _document_job(job: Job, msg):
+    downloaded = []
+    try:
+        _handle_upload(job, msg, downloaded)
+    finally:
+        for path in downloaded:   # merge uploads were moved into the session store
+            path.unlink(missing_ok=True)
+
+def _handle_upload(job: Job, msg, downloaded: List[Path]):
     doc = msg.document
-    file_info = bot.get_file(doc.file_id)
-    b = bot.download_file(file_info.file_path)
     fname = doc.file_name or ""
     sess = user_sessions.get(msg.chat.id, {})
     flow = sess.get('flow')
+    dedup = sess.get('dedup')
+
+    def fetch() -> Path:
+        # download on first use only; cache hits never touch the file
+        if not downloaded:
+            check_download_size(doc.file_size)
+            with metrics.timed("download"):
+                file_info = bot.get_file(doc.file_id)
+                downloaded.append(download_to_file(file_info.file_path, Path(fname).suffix))
+            metrics.inc("vcfbot_bytes_total", downloaded[0].stat().st_size, direction="download")
+            job.check()
+        return downloaded[0]
+
+    def parse(parse_fn, *extra):
+        key = ("parse", doc.file_unique_id, parse_fn.__name__, dedup, extra)
+        hit = conversion_cache.get(*key)
+        if hit is not None:
+            return hit
+        data = fetch()
+        t0 = time.perf_counter()
+        res = scheduler.run_cpu(job, parse_and_dedup, dedup, parse_fn, data, *extra, stage=parse_fn.__name__)
+        metrics.record_contacts(parse_fn.__name__, len(res[0]), time.perf_counter() - t0)
+        conversion_cache.put(res, *key)
+        return res
 
     # collect for merges
     if msg.chat.id in merge_vcf_store and fname.lower().endswith('.vcf'):
-        merge_vcf_store[msg.chat.id].append(b)
-        bot.send_message(msg.chat.id, f"Collected {len(merge_vcf_store[msg.chat.id])} vcf(s). Send more or /done_merge")
+        n = merge_vcf_store.append(msg.chat.id, fetch())
+        outbox.progress(msg.chat.id, "merge", f"Collected {n} vcf(s). Send more or /done_merge")
         return
     if msg.chat.id in merge_txt_store and fname.lower().endswith('.txt'):
-        txt = b.decode('utf-8', errors='ignore')
-        merge_txt_store[msg.chat.id].append(txt)
-        bot.send_message(msg.chat.id, f"Collected {len(merge_txt_store[msg.chat.id])} txt(s). Send more or /done_merge_txt")
+        n = merge_txt_store.append(msg.chat.id, fetch())
+        outbox.progress(msg.chat.id, "merge", f"Collected {n} txt(s). Send more or /done_merge_txt")
         return
 
     # flows
     if flow == 'txt2vcf_wait_file':
         if not fname.lower().endswith('.txt'):
-            bot.send_message(msg.chat.id, "Please send a .txt file as document"); user_sessions.pop(msg.chat.id, None); return
-        text = b.decode('utf-8', errors='ignore')
-        contacts = parse_txt_contacts(text)
+            send_message(msg.chat.id, "Please send a .txt file as document"); user_sessions.pop(msg.chat.id, None); return
+        contacts, dropped = parse(parse_txt_contacts, DEFAULT_COUNTRY_CODE)
         if not contacts:
-            bot.send_message(msg.chat.id, "No contacts found in TXT."); user_sessions.pop(msg.chat.id, None); return
-        user_sessions[msg.chat.id] = {'flow':'txt2vcf_wait_options','contacts':contacts}
-        bot.send_message(msg.chat.id, f"Found {len(contacts)} contacts.\nReply with options:\n<contacts_per_vcf>,<vcf_prefix>,<contact_name_prefix>\nOR: single,<vcf_prefix>,<contact_name_prefix>\nYou can give sequence template like 'A2D' or explicit 'A2D A3D A4D'")
+            send_message(msg.chat.id, "No contacts found in TXT."); user_sessions.pop(msg.chat.id, None); return
+        user_sessions[msg.chat.id] = {'flow':'txt2vcf_wait_options','contacts':contacts,'source':doc.file_unique_id,'dedup':dedup}
+        send_message(msg.chat.id, f"Found {len(contacts)} contacts{dedup_note(dropped)}.\nReply with options:\n<contacts_per_vcf>,<vcf_prefix>,<contact_name_prefix>\nOR: single,<vcf_prefix>,<contact_name_prefix>\nYou can give sequence template like 'A2D' or explicit 'A2D A3D A4D'")
         return
 
     if flow == 'xlsx2vcf_wait_file':
-        if not (fname.lower().endswith('.xlsx') or fname.lower().endswith('.xls')):
-            bot.send_message(msg.chat.id, "Please send an Excel (.xlsx) file as document"); user_sessions.pop(msg.chat.id,None); return
+        if not fname.lower().endswith(('.xlsx', '.xls', '.csv')):
+            send_message(msg.chat.id, "Please send an Excel (.xlsx) or .csv file as document"); user_sessions.pop(msg.chat.id,None); return
         try:
-            contacts = parse_xlsx_contacts_bytes(b)
+            contacts, dropped = parse(parse_sheet_contacts, fname)
+        except JobCancelled:
+            raise
         except Exception as e:
-            bot.send_message(msg.chat.id, f"Failed to parse Excel: {e}"); user_sessions.pop(msg.chat.id,None); return
+            send_message(msg.chat.id, f"Failed to parse Excel: {e}"); user_sessions.pop(msg.chat.id,None); return
         if not contacts:
-            bot.send_message(msg.chat.id, "No contacts found in Excel."); user_sessions.pop(msg.chat.id,None); return
-        user_sessions[msg.chat.id] = {'flow':'xlsx2vcf_wait_options','contacts':contacts}
-        bot.send_message(msg.chat.id, f"Found {len(contacts)} contacts in Excel.\nReply with options like TXT flow.")
+            send_message(msg.chat.id, "No contacts found in Excel."); user_sessions.pop(msg.chat.id,None); return
+        user_sessions[msg.chat.id] = {'flow':'xlsx2vcf_wait_options','contacts':contacts,'source':doc.file_unique_id,'dedup':dedup}
+        send_message(msg.chat.id, f"Found {len(contacts)} contacts in Excel{dedup_note(dropped)}.\nReply with options like TXT flow.")
         return
 
     if flow == 'vcf2txt_wait_file':
         if not fname.lower().endswith('.vcf'):
-            bot.send_message(msg.chat.id, "Please send a .vcf file."); user_sessions.pop(msg.chat.id,None); return
-        contacts = parse_vcf_to_contacts(b)
-        if not contacts:
-            bot.send_message(msg.chat.id, "No contacts found in VCF."); user_sessions.pop(msg.chat.id,None); return
-        lines = [f"{n}|{p}" for n,p in contacts]
+            send_message(msg.chat.id, "Please send a .vcf file."); user_sessions.pop(msg.chat.id,None); return
         outname = Path(fname).stem + ".txt"
-        bot.send_document(msg.chat.id, InputFile(io.BytesIO("\n".join(lines).encode('utf-8')), filename=outname))
+        out_key = ("out", doc.file_unique_id, "vcf2txt", outname)
+        file_id = conversion_cache.get(*out_key)
+        if file_id:
+            send_document(msg.chat.id, file_id)
+            user_sessions.pop(msg.chat.id,None); return
+        path = _temp_path(".txt")
+        if not scheduler.run_cpu(job, vcf_to_txt_file, fetch(), path):
+            os.unlink(path)
+            send_message(msg.chat.id, "No contacts found in VCF."); user_sessions.pop(msg.chat.id,None); return
+        sent = send_path(msg.chat.id, path, outname)
+        remember_output(out_key, sent)
         user_sessions.pop(msg.chat.id,None); return
 
     if flow == 'split_vcf_wait_file':
         if not fname.lower().endswith('.vcf'):
-            bot.send_message(msg.chat.id, "Please send a .vcf file."); user_sessions.pop(msg.chat.id,None); return
-        contacts = parse_vcf_to_contacts(b)
+            send_message(msg.chat.id, "Please send a .vcf file."); user_sessions.pop(msg.chat.id,None); return
+        contacts, dropped = parse(parse_vcf_to_contacts)
         if not contacts:
-            bot.send_message(msg.chat.id, "No contacts parsed"); user_sessions.pop(msg.chat.id,None); return
-        user_sessions[msg.chat.id] = {'flow':'split_vcf_wait_count', 'contacts':contacts}
-        bot.send_message(msg.chat.id, "Enter number of contacts per output VCF (integer):")
+            send_message(msg.chat.id, "No contacts parsed"); user_sessions.pop(msg.chat.id,None); return
+        user_sessions[msg.chat.id] = {'flow':'split_vcf_wait_count', 'contacts':contacts,'source':doc.file_unique_id,'dedup':dedup,'stem':Path(fname).stem}
+        send_message(msg.chat.id, f"Found {len(contacts)} contacts{dedup_note(dropped)}.\nEnter number of contacts per output VCF (integer):")
         return
 
     if flow == 'split_txt_wait_file':
         if not fname.lower().endswith('.txt'):
-            bot.send_message(msg.chat.id, "Please send a .txt file."); user_sessions.pop(msg.chat.id,None); return
-        text = b.decode('utf-8', errors='ignore')
-        contacts = parse_txt_contacts(text)
+            send_message(msg.chat.id, "Please send a .txt file."); user_sessions.pop(msg.chat.id,None); return
+        contacts, dropped = parse(parse_txt_contacts, DEFAULT_COUNTRY_CODE)
         if not contacts:
-            bot.send_message(msg.chat.id, "No contacts parsed"); user_sessions.pop(msg.chat.id,None); return
-        user_sessions[msg.chat.id] = {'flow':'split_txt_wait_count','contacts':contacts}
-        bot.send_message(msg.chat.id, "Enter number of contacts per output TXT (integer):")
+            send_message(msg.chat.id, "No contacts parsed"); user_sessions.pop(msg.chat.id,None); return
+        user_sessions[msg.chat.id] = {'flow':'split_txt_wait_count','contacts':contacts,'source':doc.file_unique_id,'dedup':dedup,'stem':Path(fname).stem}
+        send_message(msg.chat.id, f"Found {len(contacts)} contacts{dedup_note(dropped)}.\nEnter number of contacts per output TXT (integer):")
         return
 
-    # default convert 
+    # default convert
+
+# ---------------------------
+# text replies (counts / options)
+# ---------------------------
+@bot.message_handler(content_types=['text'])
+def handle_text(msg):
+    # plain text from users without access is ignored; only commands get the deny reply
+    if not is_allowed(msg.from_user.id):
+        return
+    sess = user_sessions.get(msg.chat.id, {})
+    if sess.get('flow') in ('split_vcf_wait_count', 'split_txt_wait_count',
+                            'txt2vcf_wait_options', 'xlsx2vcf_wait_options'):
+        submit_job(msg.chat.id, _text_job, msg.text.strip())
+
+def _text_job(job: Job, text: str):
+    chat_id = job.chat_id
+    sess = user_sessions.get(chat_id, {})
+    flow = sess.get('flow')
+    contacts = user_sessions.contacts(chat_id)
+    if not contacts:
+        user_sessions.pop(chat_id, None); return
+    # the stem names split outputs, so it is part of what the upload looked like
+    cache_key = ("out", sess.get('source'), flow, sess.get('dedup'), sess.get('stem'), text)
+
+    if flow in ('split_vcf_wait_count', 'split_txt_wait_count'):
+        try:
+            per_file = int(text)
+            if per_file <= 0:
+                raise ValueError
+        except ValueError:
+            send_message(chat_id, "Please send a positive integer."); return
+        if resend_cached(chat_id, cache_key):
+            user_sessions.pop(chat_id, None); return
+        kind = "vcf" if flow == 'split_vcf_wait_count' else "txt"
+        stem = sess.get('stem') or "split"
+        names = [f"{stem}_{i + 1}" for i in range((len(contacts) + per_file - 1) // per_file)]
+        # the job keeps its own copy of the contacts, so free the session's first
+        user_sessions.pop(chat_id, None)
+        deliver_chunks(job, kind, contacts, per_file, names, f"{stem}_split.zip", cache_key); return
+
+    # txt2vcf / xlsx2vcf options: <per_file|single>,<vcf_prefix>,<contact_name_prefix>
+    parts = [p.strip() for p in text.split(",")]
+    if parts[0].lower() == "single":
+        per_file = len(contacts)
+    else:
+        try:
+            per_file = int(parts[0])
+            if per_file <= 0:
+                raise ValueError
+        except ValueError:
+            send_message(chat_id, "Options: <contacts_per_vcf>,<vcf_prefix>,<contact_name_prefix> OR single,<vcf_prefix>,<contact_name_prefix>"); return
+    if resend_cached(chat_id, cache_key):
+        user_sessions.pop(chat_id, None); return
+    vcf_prefix = parts[1] if len(parts) > 1 else ""
+    name_prefix = parts[2] if len(parts) > 2 else ""
+    if name_prefix:
+        names = generate_sequence_from_template(name_prefix, len(contacts))
+        contacts = [(n, p) for n, (_, p) in zip(names, contacts)]
+    filenames = generate_sequence_from_template(vcf_prefix, (len(contacts) + per_file - 1) // per_file)
+    user_sessions.pop(chat_id, None)
+    deliver_chunks(job, "vcf", contacts, per_file, filenames,
+                   f"{vcf_prefix.split()[0] if vcf_prefix else 'contacts'}.zip", cache_key)
+
+# ---------------------------
+# web endpoints & entry point
+# ---------------------------
+update_queue = queue.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+shared_updates = None   # SharedUpdateQueue in the multi-process ingest
+
+metrics.gauge("vcfbot_queue_depth", "Items waiting per queue", lambda: {
+    "jobs": scheduler.queue_depth(), "outbox": outbox.depth(),
+    "updates": shared_updates.depth() if shared_updates is not None else update_queue.qsize()})
+metrics.gauge("vcfbot_session_store_bytes", "Bytes held by the session store", session_store.total_bytes)
+metrics.gauge("vcfbot_acl_cache_hit_ratio", "Access-control cache hit ratio", acl_cache_hit_rate)
+metrics.gauge("vcfbot_acl_cache_lookups", "Access-control cache lookups", lambda: dict(acl_cache_stats))
+metrics.gauge("vcfbot_conversion_cache_lookups", "Conversion cache lookups", lambda: dict(conversion_cache.stats))
+metrics.gauge("vcfbot_startup_seconds", "Startup phase durations", lambda: dict(startup_phases))
+metrics.gauge("vcfbot_outbox_events", "Outbound sends, 429 retries, coalesced acks", lambda: dict(outbox.stats))
+
+@app.route("/metrics")
+def metrics_endpoint():
+    if shared_updates is None:
+        return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+    # multi-process: merge this process with the snapshots the workers flush
+    texts = [metrics.render(process="ingest")]
+    for shard in range(shared_updates.shards):
+        try:
+            with open(os.path.join(METRICS_DIR, f"worker{shard}.prom"), encoding="utf-8") as fh:
+                texts.append(fh.read())
+        except FileNotFoundError:
+            pass
+    return merge_metrics(texts), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+@app.route("/")
+def keepalive():
+    return jsonify(status="ok", mode=BOT_MODE)
+
+@app.route(WEBHOOK_PATH, methods=["POST"])
+def webhook():
+    token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(token, WEBHOOK_SECRET):
+        abort(403)
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or "update_id" not in payload:
+        abort(400)
+    if shared_updates is not None:
+        shared_updates.put(payload)
+        return jsonify(ok=True)
+    try:
+        update_queue.put_nowait(payload)
+    except queue.Full:
+        # non-2xx makes Telegram redeliver later instead of us dropping it
+        return jsonify(ok=False, error="busy"), 503
+    return jsonify(ok=True)
+
+def _update_worker():
+    while True:
+        payload = update_queue.get()
+        try:
+            bot.process_new_updates([telebot.types.Update.de_json(payload)])
+        except Exception:
+            traceback.print_exc()
+        finally:
+            update_queue.task_done()
+
+def start_update_workers(n: int = WEBHOOK_WORKERS):
+    # handlers run on these workers directly instead of telebot's own pool
+    bot.threaded = False
+    for i in range(n):
+        threading.Thread(target=_update_worker, name=f"update-{i}", daemon=True).start()
+
+def run_web():
+    app.run(host="0.0.0.0", port=WEB_PORT, threaded=True)
+
+# ---------------------------
+# multi-process mode (BOT_PROCESSES > 1)
+# ---------------------------
+# The ingest process (polling or webhook) appends raw updates to an SQLite
+# queue; worker i handles the chats with chat_id % N == i, in order. Sessions,
+# merge blobs, jobs, access roles and the conversion cache are already on disk
+# and shared through SESSION_DIR / ACCESS_DB / CACHE_DIR.
+def update_chat_id(payload: dict) -> int:
+    for key, obj in payload.items():
+        if key == "update_id" or not isinstance(obj, dict):
+            continue
+        chat = obj.get("chat") or (obj.get("message") or {}).get("chat") or obj.get("from") or {}
+        return chat.get("id", 0)
+    return 0
+
+class SharedUpdateQueue:
+    def __init__(self, path: str, shards: int):
+        self.path = path
+        self.shards = shards
+        self._local = threading.local()
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            cols = {r[1] for r in db.execute("PRAGMA table_info(updates)")}
+            if cols and "seq" not in cols:
+                # queues from before the seq cursor: rebuild keeping pending rows in order
+                db.execute("ALTER TABLE updates RENAME TO updates_old")
+                db.execute("DROP INDEX IF EXISTS updates_shard")
+            # seq is handed out under the write lock, so it follows commit order
+            # even when webhook requests insert update_ids out of order; acked
+            # rows stay as tombstones (payload dropped) so redeliveries are ignored
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS updates (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT, update_id INTEGER NOT NULL UNIQUE,
+                    shard INTEGER NOT NULL, payload TEXT, acked REAL)""")
+            db.execute("CREATE INDEX IF NOT EXISTS updates_shard ON updates (shard, seq)")
+            db.execute("CREATE INDEX IF NOT EXISTS updates_acked ON updates (acked)")
+            if cols and "seq" not in cols:
+                db.execute("INSERT INTO updates (update_id, shard, payload) "
+                           "SELECT update_id, shard, payload FROM updates_old ORDER BY update_id")
+                db.execute("DROP TABLE updates_old")
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def _db(self) -> sqlite3.Connection:
+        return wal_connection(self._local, self.path)
+
+    def put(self, payload: dict):
+        # update_id is unique, so a redelivered update (even one already acked) is stored once
+        self._db().execute("INSERT OR IGNORE INTO updates (update_id, shard, payload) VALUES (?,?,?)",
+                           (payload["update_id"], update_chat_id(payload) % self.shards, json.dumps(payload)))
+
+    def take(self, shard: int, after: int = 0, limit: int = 100) -> List[Tuple[int, dict]]:
+        # (seq, payload) pairs; pass the last seq back as `after`
+        rows = self._db().execute("SELECT seq, payload FROM updates WHERE shard=? AND seq>? AND acked IS NULL "
+                                  "ORDER BY seq LIMIT ?", (shard, after, limit)).fetchall()
+        return [(seq, json.loads(p)) for seq, p in rows]
+
+    def ack(self, seq: int):
+        self._db().execute("UPDATE updates SET payload=NULL, acked=? WHERE seq=?", (time.time(), seq))
+
+    def prune(self, keep: float = UPDATE_KEEP_ACKED):
+        self._db().execute("DELETE FROM updates WHERE acked < ?", (time.time() - keep,))
+
+    def last_update_id(self):
+        return self._db().execute("SELECT MAX(update_id) FROM updates").fetchone()[0]
+
+    def depth(self) -> int:
+        return self._db().execute("SELECT COUNT(*) FROM updates WHERE acked IS NULL").fetchone()[0]
+
+_update_jobs = threading.local()   # jobs submitted while the worker handles one update
+
+def _flush_metrics(shard: int):
+    path = os.path.join(METRICS_DIR, f"worker{shard}.prom")
+    while True:
+        try:
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as fh:
+                fh.write(metrics.render(process=f"worker{shard}"))
+            os.replace(tmp, path)
+        except Exception:
+            traceback.print_exc()
+        time.sleep(METRICS_FLUSH)
+
+def _handle_update(payload: dict) -> List[Job]:
+    _update_jobs.jobs = []
+    try:
+        bot.process_new_updates([telebot.types.Update.de_json(payload)])
+    except Exception:
+        traceback.print_exc()
+    finally:
+        jobs, _update_jobs.jobs = _update_jobs.jobs, None
+    return jobs
+
+def run_worker(shard: int, shards: int):
+    # handlers run inline so one chat's updates are applied in arrival order;
+    # an update is acked only once its handler and the jobs it submitted
+    # have finished, so a crashed worker replays it on restart (at-least-once)
+    bot.threaded = False
+    updates = SharedUpdateQueue(UPDATE_DB, shards)
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    threading.Thread(target=_flush_metrics, args=(shard,), name="metrics-flush", daemon=True).start()
+    resume_jobs(shard=(shard, shards))
+    start_prewarm()
+    print(f"Worker {shard}/{shards} consuming {UPDATE_DB}")
+    parent = os.getppid()
+    pending = {}   # seq -> jobs still running
+    last = 0
+    idle = 0.05
+    while True:
+        for seq, jobs in list(pending.items()):
+            if all(j.done.is_set() for j in jobs):
+                updates.ack(seq)
+                del pending[seq]
+        batch = updates.take(shard, after=last)
+        if not batch:
+            if os.getppid() != parent:   # supervisor is gone
+                return
+            time.sleep(idle)
+            idle = min(idle * 2, 0.5)
+            continue
+        idle = 0.05
+        for seq, payload in batch:
+            last = seq
+            pending[seq] = _handle_update(payload)
+
+def _spawn_worker(shard: int, shards: int) -> subprocess.Popen:
+    env = dict(os.environ, SESSION_RECOVER="0",
+               # the Bot API global limit is split across workers; chats are
+               # already pinned to one worker so per-chat pacing is unchanged
+               OUTBOX_GLOBAL_RATE=str(OUTBOX_GLOBAL_RATE / shards))
+    env.setdefault("CPU_WORKERS", "0")   # one core per worker process instead of a pool each
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), "worker", str(shard), str(shards)], env=env)
+
+def _supervise(procs: dict, shards: int):
+    pruned = time.monotonic()
+    while True:
+        time.sleep(2)
+        if time.monotonic() - pruned > 60:
+            pruned = time.monotonic()
+            shared_updates.prune()
+        for shard, proc in list(procs.items()):
+            if proc.poll() is not None:
+                print(f"Worker {shard} exited with {proc.returncode}; restarting")
+                procs[shard] = _spawn_worker(shard, shards)
+
+def _poll_into(updates: SharedUpdateQueue):
+    # resume after the newest stored update so a restarted ingest does not
+    # fetch (and re-run) what the workers already handled
+    last = updates.last_update_id()
+    offset = last + 1 if last is not None else None
+    while True:
+        try:
+            batch = apihelper.get_updates(bot.token, offset, 100, 25, None, 30)
+        except Exception:
+            traceback.print_exc()
+            time.sleep(3)
+            continue
+        for payload in batch:
+            updates.put(payload)
+            offset = payload["update_id"] + 1
+
+def run_multiprocess(shards: int):
+    global shared_updates
+    shared_updates = SharedUpdateQueue(UPDATE_DB, shards)
+    procs = {i: _spawn_worker(i, shards) for i in range(shards)}
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))   # run the finally below
+    threading.Thread(target=_supervise, args=(procs, shards), name="supervisor", daemon=True).start()
+    try:
+        if BOT_MODE == "webhook":
+            if WEBHOOK_URL:
+                bot.set_webhook(url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                                max_connections=100, drop_pending_updates=False)
+            print(startup_report())
+            print(f"Serving webhook on :{WEB_PORT}{WEBHOOK_PATH} for {shards} workers")
+            run_web()
+        else:
+            threading.Thread(target=run_web, name="keepalive", daemon=True).start()
+            bot.remove_webhook()
+            print(startup_report())
+            print(f"Polling into {UPDATE_DB} for {shards} workers...")
+            _poll_into(shared_updates)
+    finally:
+        for proc in procs.values():
+            proc.terminate()
+
+mark_startup("module init")
+
+def main(argv: List[str] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["worker"]:
+        run_worker(int(argv[1]), int(argv[2])); return
+    if BOT_PROCESSES > 1:
+        run_multiprocess(BOT_PROCESSES); return
+    if BOT_MODE == "webhook":
+        start_update_workers()
+        if WEBHOOK_URL:
+            bot.set_webhook(url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                            max_connections=WEBHOOK_WORKERS * 10, drop_pending_updates=False)
+        mark_startup("webhook setup")
+        print(startup_report())
+        start_prewarm()
+        resume_jobs()
+        print(f"Serving webhook on :{WEB_PORT}{WEBHOOK_PATH}")
+        run_web()
+    else:
+        threading.Thread(target=run_web, name="keepalive", daemon=True).start()
+        bot.remove_webhook()
+        mark_startup("webhook removal")
+        print(startup_report())
+        start_prewarm()
+        resume_jobs()
+        print("Bot polling...")
+        bot.infinity_polling(skip_pending=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1459 @@
+#!/usr/bin/env python3
+"""
+Shared core of bot.py and async_bot.py: configuration, access control, metrics,
+contact parsing, session / cache storage and the CPU-side conversion tasks.
+
+Importing this module has no side effects: the SQLite stores and the cache
+directory are opened on first use, and no threads start until asked.
+"""
+
+import time
+_BOOT_T0 = time.perf_counter()   # startup phases are measured from here
+import os
+import io
+import csv
+import re
+import itertools
+import zipfile
+import tempfile
+import traceback
+import threading
+from contextlib import contextmanager
+import secrets
+import hashlib
+import json
+import shutil
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple, Union
+# pandas/openpyxl are imported on first spreadsheet job (or by the prewarm thread)
+
+# ---------------------------
+# startup timing
+# ---------------------------
+startup_phases = OrderedDict()   # phase -> seconds
+_phase_mark = [_BOOT_T0]
+
+def mark_startup(phase: str):
+    now = time.perf_counter()
+    startup_phases[phase] = now - _phase_mark[0]
+    _phase_mark[0] = now
+
+def startup_report() -> str:
+    total = _phase_mark[0] - _BOOT_T0
+    return "Startup: " + ", ".join(f"{k} {v * 1000:.0f}ms" for k, v in startup_phases.items()) + f" (total {total * 1000:.0f}ms)"
+
+# ---------------------------
+# CONFIG - Replace / Env Var
+# ---------------------------
+BOT_TOKEN = os.getenv("8421126137:AAE3lsRd6DS4lRZ_bqGGGi3uvEDq9vUwkvw") or "REPLACE_WITH_YOUR_BOT_TOKEN"
+OWNER_ID = int(os.getenv("6497509361") or "123456789")  # replace with your numeric id if not using env
+ADMIN_KEY = os.getenv("ADMIN_KEY") or "000000"
+# Import pandas/openpyxl and open the access DB in the background once the bot is online
+STARTUP_PREWARM = os.getenv("STARTUP_PREWARM", "1") == "1"
+ACCESS_DB = os.getenv("ACCESS_DB") or "access.db"
+
+# Uploads are streamed to disk; anything over the cap is refused before/while downloading
+MAX_DOWNLOAD_BYTES = int(os.getenv("MAX_DOWNLOAD_BYTES", 20 * 1024 * 1024))  # Bot API getFile limit
+DOWNLOAD_CHUNK = int(os.getenv("DOWNLOAD_CHUNK", 64 * 1024))
+VCF_WRITE_BATCH = 2048  # contacts serialised per buffered write
+
+# Country code used to canonicalise TXT numbers to E.164 (e.g. "91"); empty = keep as written
+DEFAULT_COUNTRY_CODE = os.getenv("DEFAULT_COUNTRY_CODE", "")
+
+# XLSX/CSV ingestion: rows used to sniff headers, rows normalised per batch
+XLSX_SNIFF_ROWS = 20
+XLSX_CHUNK_ROWS = 5000
+
+# Outbound pacing (Telegram allows ~30 msg/s overall, ~1 msg/s per chat)
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", 8))
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", 25))
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", 1))
+OUTBOX_CHAT_BURST = float(os.getenv("OUTBOX_CHAT_BURST", 3))
+OUTBOX_MAX_RETRIES = int(os.getenv("OUTBOX_MAX_RETRIES", 5))
+OUTBOX_PROGRESS_EVERY = float(os.getenv("OUTBOX_PROGRESS_EVERY", 3))  # min seconds between edits of one progress message
+
+# Job scheduler limits
+IO_WORKERS = int(os.getenv("IO_WORKERS", 8))
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", os.cpu_count() or 2))  # 0 = parse inline
+CPU_TIMEOUT = float(os.getenv("CPU_TIMEOUT", 600))  # seconds one CPU task may run before its pool is recycled
+PER_USER_JOBS = int(os.getenv("PER_USER_JOBS", 1))
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", 100))
+
+# Session / merge-upload storage (spilled to disk, expired by TTL then LRU)
+SESSION_DIR = os.getenv("SESSION_DIR") or os.path.join(tempfile.gettempdir(), "vcfbot_sessions")
+SESSION_TTL = int(os.getenv("SESSION_TTL", 6 * 3600))
+SESSION_USER_MAX_BYTES = int(os.getenv("SESSION_USER_MAX_BYTES", 200 * 1024 * 1024))
+SESSION_TOTAL_MAX_BYTES = int(os.getenv("SESSION_TOTAL_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))   # resumes of one interrupted conversion before it is dropped
+
+# Conversion cache (parsed uploads and output file_ids by file_unique_id)
+CACHE_DIR = os.getenv("CACHE_DIR") or os.path.join(tempfile.gettempdir(), "vcfbot_cache")
+CACHE_MEM_CONTACTS = int(os.getenv("CACHE_MEM_CONTACTS", 500_000))
+CACHE_DISK_BYTES = int(os.getenv("CACHE_DISK_BYTES", 512 * 1024 * 1024))
+
+# Split outputs: more files than ZIP_THRESHOLD are bundled into ZIP archives
+ZIP_THRESHOLD = int(os.getenv("ZIP_THRESHOLD", 5))
+ZIP_LEVEL = int(os.getenv("ZIP_LEVEL", 6))
+ZIP_MAX_BYTES = int(os.getenv("ZIP_MAX_BYTES", 45 * 1024 * 1024))  # Telegram bot upload limit is 50 MB
+
+# Replit port (UptimeRobot uses this)
+WEB_PORT = int(os.getenv("PORT", 5000))
+
+# Update ingestion: "polling" (getUpdates) or "webhook" (Telegram POSTs to the Flask app)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")          # public base URL; empty = serve without registering
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 4))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))
+
+# Multi-process mode: one ingest process feeds BOT_PROCESSES workers through a
+# SQLite update queue sharded by chat_id % BOT_PROCESSES (1 = single process)
+BOT_PROCESSES = int(os.getenv("BOT_PROCESSES", 1))
+UPDATE_DB = os.getenv("UPDATE_DB") or os.path.join(SESSION_DIR, "updates.db")
+UPDATE_KEEP_ACKED = int(os.getenv("UPDATE_KEEP_ACKED", 24 * 3600))   # seconds acked ids are kept to drop redeliveries
+METRICS_DIR = os.getenv("METRICS_DIR") or os.path.join(SESSION_DIR, "metrics")   # worker snapshots for /metrics
+METRICS_FLUSH = float(os.getenv("METRICS_FLUSH", 10))   # seconds between worker snapshots
+SESSION_RECOVER = os.getenv("SESSION_RECOVER", "1") == "1"   # workers leave blob recovery to the ingest process
+ACL_RECHECK = float(os.getenv("ACL_RECHECK", 1.0 if BOT_PROCESSES > 1 else 0))  # seconds; 0 = this process is the only writer
+
+# ---------------------------
+# access store
+# ---------------------------
+def wal_connection(local: threading.local, path: str) -> sqlite3.Connection:
+    # one autocommit connection per thread for the SQLite stores below
+    conn = getattr(local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        local.conn = conn
+    return conn
+
+# Roles live in SQLite keyed on (role, id) so membership writes touch one
+# row instead of rewriting a JSON file; WAL lets readers run alongside.
+class AccessStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._watch = None
+        self._watch_lock = threading.Lock()
+        self._db().execute("""
+            CREATE TABLE IF NOT EXISTS access (
+                role TEXT NOT NULL, id INTEGER NOT NULL,
+                PRIMARY KEY (role, id))""")
+
+    def _db(self) -> sqlite3.Connection:
+        return wal_connection(self._local, self.path)
+
+    def all(self) -> List[Tuple[str,int]]:
+        # rowid order keeps the first recorded owner first
+        return self._db().execute("SELECT role, id FROM access ORDER BY rowid").fetchall()
+
+    def add(self, role: str, ids: Iterable[int]) -> int:
+        db = self._db()
+        with db:
+            db.execute("BEGIN")
+            before = db.total_changes
+            db.executemany("INSERT OR IGNORE INTO access (role, id) VALUES (?,?)", ((role, i) for i in ids))
+            return db.total_changes - before
+
+    def remove(self, role: str, uid: int) -> int:
+        return self._db().execute("DELETE FROM access WHERE role=? AND id=?", (role, uid)).rowcount
+
+    def data_version(self) -> int:
+        # changes whenever another connection (or process) commits
+        with self._watch_lock:
+            if self._watch is None:
+                self._watch = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            return self._watch.execute("PRAGMA data_version").fetchone()[0]
+
+    def migrate_json(self, path: str) -> int:
+        # one-shot import of the old TinyDB file: {"access": {"<doc_id>": {"role", "id"}}}
+        if not os.path.exists(path):
+            return 0
+        with open(path, encoding="utf-8") as fh:
+            raw = json.load(fh)
+        docs = raw.get("access", {})
+        rows = [docs[k] for k in sorted(docs, key=lambda k: int(k) if k.isdigit() else 0)]
+        n = 0
+        for r in rows:
+            if r.get("role") in ("owner", "admin", "user") and isinstance(r.get("id"), int):
+                n += self.add(r["role"], [r["id"]])
+        os.replace(path, path + ".migrated")
+        return n
+
+LEGACY_DB_FILE = "users_db.json"
+_access_store = None
+
+def get_access_store() -> AccessStore:
+    # opened on first permission check rather than at import
+    global _access_store
+    if _access_store is None:
+        with _acl_lock:
+            if _access_store is None:
+                store = AccessStore(ACCESS_DB)
+                migrated = store.migrate_json(LEGACY_DB_FILE)
+                if migrated:
+                    print(f"Migrated {migrated} access records from {LEGACY_DB_FILE} to {ACCESS_DB}")
+                store.add("owner", [OWNER_ID])   # ensure owner recorded
+                _access_store = store
+    return _access_store
+
+# ---------------------------
+# access-control cache
+# ---------------------------
+# One query builds frozen sets of every role; writes go through the
+# helpers below, which drop the snapshot under the same lock.
+_acl_lock = threading.RLock()
+_acl_cache = None
+_acl_watch = {"checked": 0.0, "version": None}
+acl_cache_stats = {"hits": 0, "misses": 0}
+
+def _acl_recheck():
+    # other processes write the same DB; drop the snapshot when it changed
+    _acl_watch["checked"] = time.monotonic()
+    version = get_access_store().data_version()
+    if version != _acl_watch["version"]:
+        _acl_watch["version"] = version
+        invalidate_acl_cache()
+
+def _acl_snapshot() -> dict:
+    global _acl_cache
+    if ACL_RECHECK and time.monotonic() - _acl_watch["checked"] > ACL_RECHECK:
+        _acl_recheck()
+    snap = _acl_cache
+    if snap is not None:
+        acl_cache_stats["hits"] += 1
+        return snap
+    with _acl_lock:
+        if _acl_cache is None:
+            acl_cache_stats["misses"] += 1
+            owners, admins, users = [], set(), set()
+            for role, uid in get_access_store().all():
+                if role == "owner":
+                    owners.append(uid)
+                elif role == "admin":
+                    admins.add(uid)
+                elif role == "user":
+                    users.add(uid)
+            owner = owners[0] if owners else OWNER_ID
+            _acl_cache = {
+                "owner": owner,
+                "admins": frozenset(admins),
+                "users": frozenset(users),
+                "allowed": frozenset(admins | users | {owner}),
+            }
+        return _acl_cache
+
+def invalidate_acl_cache():
+    global _acl_cache
+    with _acl_lock:
+        _acl_cache = None
+
+def acl_cache_hit_rate() -> float:
+    total = acl_cache_stats["hits"] + acl_cache_stats["misses"]
+    return acl_cache_stats["hits"] / total if total else 0.0
+
+# ---------------------------
+# DB helper functions
+# ---------------------------
+def get_owner_id() -> int:
+    return _acl_snapshot()["owner"]
+
+def get_admin_ids() -> List[int]:
+    return list(_acl_snapshot()["admins"])
+
+def get_user_ids() -> List[int]:
+    return list(_acl_snapshot()["users"])
+
+def get_allowed_ids() -> List[int]:
+    return list(_acl_snapshot()["allowed"])
+
+def add_user_id(uid: int):
+    add_user_ids([uid])
+
+def add_user_ids(uids: Iterable[int]) -> int:
+    # one transaction for the whole list; returns how many were new
+    with _acl_lock:
+        added = get_access_store().add("user", uids)
+        invalidate_acl_cache()
+        return added
+
+def remove_user_id(uid: int):
+    with _acl_lock:
+        get_access_store().remove("user", uid)
+        invalidate_acl_cache()
+
+def add_admin_id(uid: int):
+    with _acl_lock:
+        get_access_store().add("admin", [uid])
+        invalidate_acl_cache()
+
+def remove_admin_id(uid: int):
+    with _acl_lock:
+        get_access_store().remove("admin", uid)
+        invalidate_acl_cache()
+
+_ID_SPLIT_RE = re.compile(r"[\s,;]+")
+
+def parse_user_ids(text: str) -> Tuple[List[int], List[str]]:
+    # "/adduser 1 2,3\n4" -> ([1, 2, 3, 4], []); non-numeric tokens are returned as bad
+    ids, bad = [], []
+    for tok in _ID_SPLIT_RE.split(text or "")[1:]:
+        if not tok:
+            continue
+        try:
+            ids.append(int(tok))
+        except ValueError:
+            bad.append(tok)
+    return ids, bad
+
+# ---------------------------
+# metrics
+# ---------------------------
+# Prometheus text exposition without the client library: per-stage latency
+# histograms, counters, and gauges sampled at scrape time.
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+class Histogram:
+    def __init__(self, buckets=_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v: float):
+        for i, b in enumerate(self.buckets):
+            if v <= b:
+                self.counts[i] += 1
+        self.sum += v
+        self.count += 1
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}     # stage -> Histogram
+        self.counters = {}   # (name, labels tuple) -> value
+        self.rates = {}      # stage -> last contacts/second
+        self._gauges = []    # (name, help, fn returning number or {label: number})
+
+    @contextmanager
+    def timed(self, stage: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - t0)
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages.setdefault(stage, Histogram()).observe(seconds)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def record_contacts(self, stage: str, count: int, seconds: float):
+        self.inc("vcfbot_contacts_total", count, stage=stage)
+        if seconds > 0:
+            with self._lock:
+                self.rates[stage] = count / seconds
+
+    def gauge(self, name: str, help_text: str, fn):
+        self._gauges.append((name, help_text, fn))
+
+    def render(self, process: str = None) -> str:
+        out = []
+        with self._lock:
+            out.append("# HELP vcfbot_stage_seconds Time spent per pipeline stage")
+            out.append("# TYPE vcfbot_stage_seconds histogram")
+            for stage, h in sorted(self.stages.items()):
+                for b, c in zip(h.buckets, h.counts):
+                    out.append(f'vcfbot_stage_seconds_bucket{{stage="{stage}",le="{b}"}} {c}')
+                out.append(f'vcfbot_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {h.count}')
+                out.append(f'vcfbot_stage_seconds_sum{{stage="{stage}"}} {h.sum:.6f}')
+                out.append(f'vcfbot_stage_seconds_count{{stage="{stage}"}} {h.count}')
+            seen = set()
+            for (name, labels), v in sorted(self.counters.items()):
+                if name not in seen:
+                    out.append(f"# TYPE {name} counter")
+                    seen.add(name)
+                lbl = ",".join(f'{k}="{v2}"' for k, v2 in labels)
+                out.append(f"{name}{{{lbl}}} {v}" if lbl else f"{name} {v}")
+            out.append("# TYPE vcfbot_contacts_per_second gauge")
+            for stage, r in sorted(self.rates.items()):
+                out.append(f'vcfbot_contacts_per_second{{stage="{stage}"}} {r:.1f}')
+        for name, help_text, fn in self._gauges:
+            try:
+                v = fn()
+            except Exception:
+                continue
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} gauge")
+            if isinstance(v, dict):
+                out.extend(f'{name}{{kind="{k}"}} {x}' for k, x in v.items())
+            else:
+                out.append(f"{name} {v}")
+        if process:
+            # label every sample so the ingest process can merge worker snapshots
+            out = [line if line.startswith("#") else
+                   line.replace("{", f'{{process="{process}",', 1) if "{" in line else
+                   line.replace(" ", f'{{process="{process}"}} ', 1) for line in out]
+        return "\n".join(out) + "\n"
+
+def merge_metrics(texts: List[str]) -> str:
+    # regroup several expositions by metric family (HELP/TYPE once, then all samples)
+    families = {}
+    for text in texts:
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# "):
+                family = families.setdefault(line.split()[2], {"meta": [], "samples": []})
+                if line not in family["meta"]:
+                    family["meta"].append(line)
+            elif line and family is not None:
+                family["samples"].append(line)
+    out = []
+    for family in families.values():
+        out.extend(family["meta"] + family["samples"])
+    return "\n".join(out) + "\n"
+
+metrics = Metrics()
+
+# ---------------------------
+# pacing primitive
+# ---------------------------
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def delay(self) -> float:
+        with self._lock:
+            self._refill()
+            return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        with self._lock:
+            self._refill()
+            self.tokens -= 1
+
+    def acquire(self):
+        while True:
+            d = self.delay()
+            if d <= 0:
+                with self._lock:
+                    self._refill()
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                continue
+            time.sleep(d)
+
+# ---------------------------
+# Utility functions
+# ---------------------------
+def is_owner(uid:int) -> bool:
+    return uid == _acl_snapshot()["owner"]
+
+def is_admin(uid:int) -> bool:
+    snap = _acl_snapshot()
+    return uid in snap["admins"] or uid == snap["owner"]
+
+def is_allowed(uid:int) -> bool:
+    return uid in _acl_snapshot()["allowed"]
+
+class _PhoneTable(dict):
+    # str.translate table keeping decimal digits and '+'; code points are
+    # classified on first sight and cached, so the table stays small
+    def __missing__(self, cp):
+        ch = chr(cp)
+        keep = ch if ch == "+" or ch.isdecimal() else None
+        self[cp] = keep
+        return keep
+
+_PHONE_TABLE = _PhoneTable()
+
+def normalize_phone(ph: str) -> str:
+    return str(ph or "").translate(_PHONE_TABLE)
+
+def to_e164(phone: str, country_code: str) -> str:
+    digits = phone.lstrip("+").replace("+", "")
+    cc = normalize_phone(country_code).lstrip("+")
+    if not digits or not cc:
+        return phone
+    if phone.startswith("+"):
+        return "+" + digits
+    if digits.startswith("00"):
+        return "+" + digits[2:]
+    if digits.startswith("0"):
+        return "+" + cc + digits[1:]      # national trunk prefix
+    if len(digits) > 10 and digits.startswith(cc):
+        return "+" + digits               # country code given without '+'
+    return "+" + cc + digits
+
+def vcard_entry(name: str, phone: str) -> str:
+    return f"BEGIN:VCARD\r\nVERSION:3.0\r\nN:{name};;;;\r\nFN:{name}\r\nTEL;TYPE=CELL:{phone}\r\nEND:VCARD\r\n"
+
+# fixed vCard fragments around the two per-contact fields (see vcard_entry)
+_VCARD_HEAD = b"BEGIN:VCARD\r\nVERSION:3.0\r\nN:"
+_VCARD_FN = b";;;;\r\nFN:"
+_VCARD_TEL = b"\r\nTEL;TYPE=CELL:"
+_VCARD_TAIL = b"\r\nEND:VCARD\r\n"
+
+def write_vcf(contacts: Iterable[Tuple[str,str]], fh: BinaryIO, batch_size: int = VCF_WRITE_BATCH,
+              precomputed: bool = True) -> int:
+    buf = bytearray()
+    count = 0
+    for n,p in contacts:
+        if precomputed:
+            nb = n.encode("utf-8")
+            buf += _VCARD_HEAD; buf += nb; buf += _VCARD_FN; buf += nb
+            buf += _VCARD_TEL; buf += p.encode("utf-8"); buf += _VCARD_TAIL
+        else:
+            buf += vcard_entry(n,p).encode("utf-8")
+        count += 1
+        if count % batch_size == 0:
+            fh.write(buf); buf.clear()
+    if buf:
+        fh.write(buf)
+    return count
+
+def make_vcf_bytes(contacts: Iterable[Tuple[str,str]]) -> bytes:
+    out = io.BytesIO()
+    write_vcf(contacts, out)
+    return out.getvalue()
+
+class UploadTooLarge(Exception):
+    pass
+
+def check_download_size(size: int):
+    if size and size > MAX_DOWNLOAD_BYTES:
+        raise UploadTooLarge(f"File is too large ({size / (1024*1024):.1f} MB). "
+                             f"The limit is {MAX_DOWNLOAD_BYTES / (1024*1024):g} MB.")
+
+_TXT_SPLIT_RE = re.compile(r"[,\t\|:]+")
+
+def parse_txt_contacts(text: Union[str, bytes, BinaryIO], default_cc: str = None) -> List[Tuple[str,str]]:
+    if isinstance(text, (bytes, bytearray)):
+        text = text.decode("utf-8", errors="ignore")
+    if isinstance(text, str):
+        lines = text.splitlines()
+    else:
+        # file object: decode line by line so the raw text is never held whole
+        lines = io.TextIOWrapper(text, encoding="utf-8", errors="ignore")
+    out=[]
+    append = out.append
+    split = _TXT_SPLIT_RE.split
+    table = _PHONE_TABLE
+    for raw in lines:
+        line = raw.strip()
+        if not line:
+            continue
+        parts = split(line)
+        if len(parts) == 1:
+            phone = line.translate(table)
+            name = phone
+        else:
+            # normalise every field exactly once; phone = last field with a digit
+            norms = [p.translate(table) for p in parts]
+            phone = None
+            for n in reversed(norms):
+                if n.strip("+"):
+                    phone = n
+                    break
+            name = phone
+            for p, n in zip(parts, norms):
+                if n != phone:
+                    p = p.strip()
+                    if p:
+                        name = p
+                        break
+        if phone:
+            if default_cc:
+                canon = to_e164(phone, default_cc)
+                if name == phone:
+                    name = canon
+                phone = canon
+            append((name, phone))
+    return out
+
+def _vcf_card_contacts(props: List[Tuple[str,str]]) -> Iterator[Tuple[str,str]]:
+    fn = None
+    n = None
+    tels = []
+    for key, value in props:
+        if key == "TEL":
+            tel = normalize_phone(value)
+            if tel:
+                tels.append(tel)
+        elif key == "FN" and fn is None and value.strip():
+            fn = value.strip()
+        elif key == "N" and n is None:
+            n = " ".join(p.strip() for p in reversed(value.split(";")) if p.strip()) or None
+    name = fn or n
+    for tel in tels:
+        yield (name or tel, tel)
+
+def _vcf_property(line: str):
+    head, sep, value = line.partition(":")
+    if not sep:
+        return None
+    key = head.split(";", 1)[0].rsplit(".", 1)[-1].strip().upper()
+    return key, value
+
+def iter_vcf_contacts(src: Union[bytes, BinaryIO]) -> Iterator[Tuple[str,str]]:
+    # single pass over the raw lines; only the current card is kept in memory
+    fh = io.BytesIO(src) if isinstance(src, (bytes, bytearray, memoryview)) else src
+    props = []
+    logical = None
+    for raw in fh:
+        line = raw.decode("utf-8", errors="ignore").rstrip("\r\n")
+        if line[:1] in (" ", "\t") and logical is not None:
+            logical += line[1:]   # folded continuation (RFC 6350 3.2)
+            continue
+        if logical is not None:
+            prop = _vcf_property(logical)
+            if prop:
+                if prop[0] == "END" and prop[1].strip().upper() == "VCARD":
+                    yield from _vcf_card_contacts(props)
+                    props = []
+                elif prop[0] == "BEGIN" and prop[1].strip().upper() == "VCARD":
+                    props = []
+                else:
+                    props.append(prop)
+        logical = line
+    if logical is not None:
+        prop = _vcf_property(logical)
+        if prop and not (prop[0] == "END" and prop[1].strip().upper() == "VCARD"):
+            props.append(prop)
+    yield from _vcf_card_contacts(props)
+
+def parse_vcf_to_contacts(b: Union[bytes, BinaryIO]) -> List[Tuple[str,str]]:
+    return list(iter_vcf_contacts(b))
+
+_PHONE_HEADER_KEYS = ("phone","tel","mobile","number","contact")
+_NAME_HEADER_KEYS = ("name","fullname","contact","姓名")
+_NON_PHONE_BATCH_RE = re.compile(r"[^\d\+\x00]")
+
+def _cell_str(v) -> str:
+    if v is None or (isinstance(v, float) and v != v):
+        return ""
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))   # 9876543210.0 -> "9876543210"
+    return str(v).strip()
+
+def normalize_phones(values: List[str]) -> List[str]:
+    # one regex pass over the whole column chunk instead of one per cell
+    out = _NON_PHONE_BATCH_RE.sub("", "\x00".join(values)).split("\x00")
+    if len(out) != len(values):
+        return [normalize_phone(v) for v in values]
+    return out
+
+def _sniff_columns(head: List[tuple]):
+    first = [_cell_str(v) for v in head[0]]
+    width = max(len(r) for r in head)
+    phone_idx = name_idx = None
+    for i, c in enumerate(first):
+        lc = c.lower()
+        if phone_idx is None and any(k in lc for k in _PHONE_HEADER_KEYS):
+            phone_idx = i
+        if name_idx is None and any(k in lc for k in _NAME_HEADER_KEYS):
+            name_idx = i
+    has_header = phone_idx is not None or name_idx is not None
+    if phone_idx is None:
+        best = 0
+        for i in range(width):
+            digits = sum(1 for r in head if i < len(r) and re.search(r"\d", _cell_str(r[i])))
+            if digits > best:
+                best, phone_idx = digits, i
+        if phone_idx is not None and not has_header:
+            # pandas-style header row unless the first row already holds a number
+            has_header = not (phone_idx < len(first) and re.search(r"\d", first[phone_idx]))
+    if name_idx is None or name_idx == phone_idx:
+        name_idx = next((i for i in range(width) if i != phone_idx), None)
+    return has_header, phone_idx, name_idx
+
+def _sheet_contacts(rows: Iterator[tuple]) -> Iterator[Tuple[str,str]]:
+    head = [r for r in itertools.islice(rows, XLSX_SNIFF_ROWS)]
+    head = [r for r in head if r and any(v is not None for v in r)]
+    if not head:
+        return
+    has_header, phone_idx, name_idx = _sniff_columns(head)
+    if phone_idx is None:
+        return
+    body = itertools.chain(head[1:] if has_header else head, rows)
+    while True:
+        chunk = list(itertools.islice(body, XLSX_CHUNK_ROWS))
+        if not chunk:
+            break
+        phones = normalize_phones([_cell_str(r[phone_idx]) if phone_idx < len(r) else "" for r in chunk])
+        for r, phone in zip(chunk, phones):
+            if not phone:
+                continue
+            name = _cell_str(r[name_idx]) if name_idx is not None and name_idx < len(r) else ""
+            yield (name or phone, phone)
+
+def _iter_csv_sheets(fh: BinaryIO):
+    text = io.TextIOWrapper(fh, encoding="utf-8-sig", errors="ignore", newline="")
+    sample = text.read(8192)
+    text.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
+    except csv.Error:
+        dialect = csv.excel
+    yield csv.reader(text, dialect)
+
+def _iter_xlsx_sheets(fh: BinaryIO):
+    import openpyxl
+    from openpyxl.utils.exceptions import InvalidFileException
+    try:
+        wb = openpyxl.load_workbook(fh, read_only=True, data_only=True)
+    except (InvalidFileException, zipfile.BadZipFile):
+        # legacy .xls and other formats openpyxl can't stream
+        import pandas as pd
+        fh.seek(0)
+        for df in pd.read_excel(fh, sheet_name=None, header=None).values():
+            yield df.itertuples(index=False, name=None)
+        return
+    try:
+        for ws in wb.worksheets:
+            yield ws.iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+def iter_sheet_contacts(src: Union[bytes, BinaryIO], fname: str = "") -> Iterator[Tuple[str,str]]:
+    fh = io.BytesIO(src) if isinstance(src, (bytes, bytearray, memoryview)) else src
+    sheets = _iter_csv_sheets(fh) if fname.lower().endswith(".csv") else _iter_xlsx_sheets(fh)
+    for rows in sheets:
+        yield from _sheet_contacts(iter(rows))
+
+def parse_sheet_contacts(src: Union[bytes, BinaryIO], fname: str = "") -> List[Tuple[str,str]]:
+    return list(iter_sheet_contacts(src, fname))
+
+def parse_xlsx_contacts_bytes(b: bytes) -> List[Tuple[str,str]]:
+    return parse_sheet_contacts(b)
+
+# ---------------------------
+# sequence utilities (A2D -> A3D)
+# ---------------------------
+def detect_sequence_template(s: str):
+    m = re.search(r"(\d+)", s)
+    if not m:
+        return None
+    return (s[:m.start()], int(m.group(1)), s[m.end():])
+
+def generate_sequence_from_template(template: str, count: int):
+    template = (template or "").strip()
+    if not template:
+        return [f"file{i+1}.vcf" for i in range(count)]
+    if " " in template:
+        parts = [p.strip() for p in template.split() if p.strip()]
+        if len(parts) >= count:
+            return parts[:count]
+        last = parts[-1]
+        tpl = detect_sequence_template(last)
+        seq = parts[:]
+        if tpl:
+            prefix, num, suffix = tpl
+            while len(seq) < count:
+                num += 1
+                seq.append(f"{prefix}{num}{suffix}")
+            return seq
+        while len(seq) < count:
+            seq.append(parts[-1])
+        return seq
+    tpl = detect_sequence_template(template)
+    seq=[]
+    if tpl:
+        prefix,num,suffix = tpl
+        for i in range(count):
+            seq.append(f"{prefix}{num + i}{suffix}")
+        return seq
+    else:
+        for i in range(1, count+1):
+            seq.append(f"{template}{i}")
+        return seq
+
+# ---------------------------
+# duplicate elimination
+# ---------------------------
+def _dedup_key(phone: str) -> int:
+    # compact int key; the leading "1" keeps leading zeros significant
+    digits = normalize_phone(phone)
+    if DEFAULT_COUNTRY_CODE:
+        digits = to_e164(digits, DEFAULT_COUNTRY_CODE)
+    digits = digits.replace("+", "")
+    return int("1" + digits) if digits.isdigit() else hash(digits)
+
+def dedup_contacts(contacts: Iterable[Tuple[str,str]], mode: str = "first",
+                   stats: dict = None) -> Iterator[Tuple[str,str]]:
+    # mode "first": stream, keep first-seen entry per number
+    # mode "merge": one entry per number (first-seen order), names joined
+    stats = stats if stats is not None else {}
+    stats["dropped"] = 0
+    if mode == "merge":
+        index = {}
+        for name, phone in contacts:
+            k = _dedup_key(phone)
+            ent = index.get(k)
+            if ent is None:
+                index[k] = [phone] + ([name] if name != phone else [])
+                continue
+            stats["dropped"] += 1
+            if name != phone and name not in ent[1:]:
+                ent.append(name)
+        for phone, *names in index.values():
+            yield (" / ".join(names) or phone, phone)
+        return
+    seen = set()
+    for name, phone in contacts:
+        k = _dedup_key(phone)
+        if k in seen:
+            stats["dropped"] += 1
+            continue
+        seen.add(k)
+        yield (name, phone)
+
+def parse_dedup_mode(text: str):
+    # "/cmd dedup" -> first-seen, "/cmd dedup=merge" -> merge names
+    for arg in (text or "").split()[1:]:
+        arg = arg.lower()
+        if arg in ("dedup", "dedup=first"):
+            return "first"
+        if arg in ("dedup=merge", "merge_names"):
+            return "merge"
+    return None
+
+def dedup_note(dropped: int) -> str:
+    return f" ({dropped} duplicate(s) removed)" if dropped else ""
+
+# ---------------------------
+# session & merge storage
+# ---------------------------
+# Sessions and merge uploads live in SQLite + blob files under SESSION_DIR
+# rather than in process memory, so they survive restarts and can be
+# capped per user and expired (TTL, then least-recently-used).
+class SessionQuotaExceeded(Exception):
+    pass
+
+class SessionStore:
+    def __init__(self, root: str, ttl: int, user_max_bytes: int, total_max_bytes: int, recover: bool = True):
+        self.root = root
+        self.blob_dir = os.path.join(root, "blobs")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self.db_path = os.path.join(root, "sessions.db")
+        self.ttl = ttl
+        self.user_max_bytes = user_max_bytes
+        self.total_max_bytes = total_max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._db().executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                chat_id INTEGER PRIMARY KEY, data TEXT NOT NULL,
+                bytes INTEGER NOT NULL, touched REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS collections (
+                chat_id INTEGER NOT NULL, kind TEXT NOT NULL, touched REAL NOT NULL,
+                PRIMARY KEY (chat_id, kind));
+            CREATE TABLE IF NOT EXISTS blobs (
+                chat_id INTEGER NOT NULL, kind TEXT NOT NULL, seq INTEGER NOT NULL,
+                path TEXT NOT NULL, bytes INTEGER NOT NULL,
+                PRIMARY KEY (chat_id, kind, seq));
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY, chat_id INTEGER NOT NULL, spec TEXT NOT NULL,
+                done INTEGER NOT NULL, file_ids TEXT NOT NULL, touched REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0);
+        """)
+        # contacts live in their own column, after the small fields, so reading
+        # the flow state never walks the (possibly multi-MB) contact list
+        self._add_column("sessions", "contacts TEXT")
+        self._add_column("jobs", "attempts INTEGER NOT NULL DEFAULT 0")
+        if recover:
+            self.recover()
+
+    def _db(self) -> sqlite3.Connection:
+        return wal_connection(self._local, self.db_path)
+
+    def _add_column(self, table: str, decl: str):
+        cols = {r[1] for r in self._db().execute(f"PRAGMA table_info({table})")}
+        if decl.split()[0] not in cols:
+            self._db().execute(f"ALTER TABLE {table} ADD COLUMN {decl}")
+
+    # -- sessions
+    def get_session(self, chat_id, default=None):
+        db = self._db()
+        row = db.execute("SELECT data FROM sessions WHERE chat_id=?", (chat_id,)).fetchone()
+        if row is None:
+            return default
+        db.execute("UPDATE sessions SET touched=? WHERE chat_id=?", (time.time(), chat_id))
+        return json.loads(row[0])
+
+    def get_contacts(self, chat_id) -> list:
+        row = self._db().execute("SELECT contacts FROM sessions WHERE chat_id=?", (chat_id,)).fetchone()
+        return [tuple(c) for c in json.loads(row[0])] if row and row[0] else []
+
+    def set_session(self, chat_id, data: dict, contacts: Optional[list] = None):
+        raw = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        blob = None if contacts is None else json.dumps(contacts, ensure_ascii=False, separators=(",", ":"))
+        size = len(raw) + len(blob or "")
+        self._check_quota(chat_id, size, replacing_session=True)
+        self._db().execute("INSERT OR REPLACE INTO sessions (chat_id, data, bytes, touched, contacts) VALUES (?,?,?,?,?)",
+                           (chat_id, raw, size, time.time(), blob))
+
+    def pop_session(self, chat_id, default=None):
+        data = self.get_session(chat_id, default)
+        self._db().execute("DELETE FROM sessions WHERE chat_id=?", (chat_id,))
+        return data
+
+    # -- merge collections
+    def start_collection(self, chat_id, kind: str):
+        self.drop_collection(chat_id, kind)
+        self._db().execute("INSERT OR REPLACE INTO collections (chat_id, kind, touched) VALUES (?,?,?)",
+                           (chat_id, kind, time.time()))
+
+    def has_collection(self, chat_id, kind: str) -> bool:
+        return self._db().execute("SELECT 1 FROM collections WHERE chat_id=? AND kind=?",
+                                  (chat_id, kind)).fetchone() is not None
+
+    def add_blob(self, chat_id, kind: str, data: Union[bytes, Path]) -> int:
+        # a Path (downloaded upload) is moved into the blob dir, not copied
+        size = data.stat().st_size if isinstance(data, Path) else len(data)
+        self._check_quota(chat_id, size)
+        db = self._db()
+        with self._lock:
+            seq = db.execute("SELECT COALESCE(MAX(seq), -1) + 1 FROM blobs WHERE chat_id=? AND kind=?",
+                             (chat_id, kind)).fetchone()[0]
+            path = os.path.join(self.blob_dir, f"{chat_id}_{kind}_{seq}.blob")
+            if isinstance(data, Path):
+                shutil.move(str(data), path)
+            else:
+                with open(path, "wb") as fh:
+                    fh.write(data)
+            db.execute("INSERT INTO blobs (chat_id, kind, seq, path, bytes) VALUES (?,?,?,?,?)",
+                       (chat_id, kind, seq, path, size))
+        db.execute("UPDATE collections SET touched=? WHERE chat_id=? AND kind=?", (time.time(), chat_id, kind))
+        if self.total_bytes() > self.total_max_bytes:
+            self.evict()
+        return seq + 1
+
+    def blob_paths(self, chat_id, kind: str) -> List[str]:
+        return [r[0] for r in self._db().execute(
+            "SELECT path FROM blobs WHERE chat_id=? AND kind=? ORDER BY seq", (chat_id, kind))]
+
+    def drop_collection(self, chat_id, kind: str):
+        db = self._db()
+        for path in self.blob_paths(chat_id, kind):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        db.execute("DELETE FROM blobs WHERE chat_id=? AND kind=?", (chat_id, kind))
+        db.execute("DELETE FROM collections WHERE chat_id=? AND kind=?", (chat_id, kind))
+
+    # -- chunked output jobs (resumable after a restart)
+    # the row keeps only the split options; the contacts go to a quota-counted
+    # blob (collection "job_<id>") and the chunks are rebuilt from it on resume
+    def save_job(self, job_id: str, chat_id, spec: dict, contacts: List[Tuple[str,str]]):
+        kind = f"job_{job_id}"
+        self.start_collection(chat_id, kind)
+        self.add_blob(chat_id, kind, json.dumps(contacts, ensure_ascii=False, separators=(",", ":")).encode('utf-8'))
+        self._db().execute("INSERT OR REPLACE INTO jobs (job_id, chat_id, spec, done, file_ids, touched) "
+                           "VALUES (?,?,?,0,'[]',?)", (job_id, chat_id, json.dumps(spec), time.time()))
+
+    def job_contacts(self, job_id: str, chat_id) -> Optional[List[Tuple[str,str]]]:
+        paths = self.blob_paths(chat_id, f"job_{job_id}")
+        if not paths or not os.path.exists(paths[0]):
+            return None
+        with open(paths[0], "rb") as fh:
+            return [tuple(c) for c in json.load(fh)]
+
+    def job_progress(self, job_id: str, done: int, file_ids: List[str]):
+        db = self._db()
+        now = time.time()
+        db.execute("UPDATE jobs SET done=?, file_ids=?, touched=? WHERE job_id=?",
+                   (done, json.dumps(file_ids), now, job_id))
+        db.execute("UPDATE collections SET touched=? WHERE kind=?", (now, f"job_{job_id}"))
+
+    def job_attempt(self, job_id: str) -> int:
+        db = self._db()
+        db.execute("UPDATE jobs SET attempts=attempts+1 WHERE job_id=?", (job_id,))
+        row = db.execute("SELECT attempts FROM jobs WHERE job_id=?", (job_id,)).fetchone()
+        return row[0] if row else 0
+
+    def get_job(self, job_id: str):
+        row = self._db().execute("SELECT chat_id, spec, done, file_ids FROM jobs WHERE job_id=?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), row[2], json.loads(row[3])
+
+    def pending_jobs(self, chat_id=None) -> List[Tuple[str,int]]:
+        if chat_id is None:
+            return self._db().execute("SELECT job_id, chat_id FROM jobs ORDER BY touched").fetchall()
+        return self._db().execute("SELECT job_id, chat_id FROM jobs WHERE chat_id=? ORDER BY touched",
+                                  (chat_id,)).fetchall()
+
+    def finish_job(self, job_id: str):
+        db = self._db()
+        for (chat_id,) in db.execute("SELECT chat_id FROM collections WHERE kind=?", (f"job_{job_id}",)).fetchall():
+            self.drop_collection(chat_id, f"job_{job_id}")
+        db.execute("DELETE FROM jobs WHERE job_id=?", (job_id,))
+
+    # -- accounting / eviction
+    def user_bytes(self, chat_id) -> int:
+        db = self._db()
+        s = db.execute("SELECT COALESCE(SUM(bytes), 0) FROM sessions WHERE chat_id=?", (chat_id,)).fetchone()[0]
+        b = db.execute("SELECT COALESCE(SUM(bytes), 0) FROM blobs WHERE chat_id=?", (chat_id,)).fetchone()[0]
+        return s + b
+
+    def total_bytes(self) -> int:
+        db = self._db()
+        s = db.execute("SELECT COALESCE(SUM(bytes), 0) FROM sessions").fetchone()[0]
+        b = db.execute("SELECT COALESCE(SUM(bytes), 0) FROM blobs").fetchone()[0]
+        return s + b
+
+    def _check_quota(self, chat_id, extra: int, replacing_session: bool = False):
+        used = self.user_bytes(chat_id)
+        if replacing_session:
+            row = self._db().execute("SELECT bytes FROM sessions WHERE chat_id=?", (chat_id,)).fetchone()
+            used -= row[0] if row else 0
+        if used + extra > self.user_max_bytes:
+            raise SessionQuotaExceeded(
+                f"Storage limit reached ({self.user_max_bytes // (1024*1024)} MB per user). "
+                "Finish or restart the current flow first.")
+
+    def drop_chat(self, chat_id):
+        for (kind,) in self._db().execute("SELECT kind FROM collections WHERE chat_id=?", (chat_id,)).fetchall():
+            self.drop_collection(chat_id, kind)
+        self._db().execute("DELETE FROM sessions WHERE chat_id=?", (chat_id,))
+        self._db().execute("DELETE FROM jobs WHERE chat_id=?", (chat_id,))
+
+    def evict(self) -> int:
+        db = self._db()
+        cutoff = time.time() - self.ttl
+        dropped = db.execute("DELETE FROM sessions WHERE touched<?", (cutoff,)).rowcount
+        for (job_id,) in db.execute("SELECT job_id FROM jobs WHERE touched<?", (cutoff,)).fetchall():
+            self.finish_job(job_id); dropped += 1
+        for chat_id, kind in db.execute("SELECT chat_id, kind FROM collections WHERE touched<?", (cutoff,)).fetchall():
+            self.drop_collection(chat_id, kind); dropped += 1
+        if self.total_bytes() > self.total_max_bytes:
+            lru = db.execute("""
+                SELECT chat_id, MAX(touched) t FROM (
+                    SELECT chat_id, touched FROM sessions UNION ALL
+                    SELECT chat_id, touched FROM collections)
+                GROUP BY chat_id ORDER BY t""").fetchall()
+            for chat_id, _ in lru:
+                if self.total_bytes() <= self.total_max_bytes:
+                    break
+                self.drop_chat(chat_id); dropped += 1
+        return dropped
+
+    def recover(self):
+        # reconcile rows and blob files left behind by a previous process
+        db = self._db()
+        known = set()
+        for chat_id, kind, seq, path in db.execute("SELECT chat_id, kind, seq, path FROM blobs").fetchall():
+            if os.path.exists(path):
+                known.add(os.path.abspath(path))
+            else:
+                db.execute("DELETE FROM blobs WHERE chat_id=? AND kind=? AND seq=?", (chat_id, kind, seq))
+        for name in os.listdir(self.blob_dir):
+            path = os.path.abspath(os.path.join(self.blob_dir, name))
+            if path not in known:
+                os.unlink(path)
+        self.evict()
+
+    def start_evictor(self, interval: int = 60):
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.evict()
+                except Exception:
+                    traceback.print_exc()
+        threading.Thread(target=loop, name="session-evictor", daemon=True).start()
+
+class _SessionMap:
+    # dict-style view so handlers keep the user_sessions[...] idiom
+    def __init__(self, store):
+        self._store = store   # callable returning the SessionStore
+
+    def get(self, chat_id, default=None):
+        return self._store().get_session(chat_id, default)
+
+    def __setitem__(self, chat_id, data: dict):
+        # 'contacts' is split off into its own column; read it back with contacts()
+        data = dict(data)
+        contacts = data.pop('contacts', None)
+        self._store().set_session(chat_id, data, contacts)
+
+    def contacts(self, chat_id) -> list:
+        return self._store().get_contacts(chat_id)
+
+    def __contains__(self, chat_id) -> bool:
+        return self._store().get_session(chat_id) is not None
+
+    def pop(self, chat_id, default=None):
+        return self._store().pop_session(chat_id, default)
+
+class _Collection:
+    def __init__(self, store, kind: str):
+        self._store = store
+        self.kind = kind
+
+    def start(self, chat_id):
+        self._store().start_collection(chat_id, self.kind)
+
+    def __contains__(self, chat_id) -> bool:
+        return self._store().has_collection(chat_id, self.kind)
+
+    def append(self, chat_id, data: Union[bytes, Path]) -> int:
+        return self._store().add_blob(chat_id, self.kind, data)
+
+    def paths(self, chat_id) -> List[str]:
+        return self._store().blob_paths(chat_id, self.kind)
+
+    def pop(self, chat_id):
+        self._store().drop_collection(chat_id, self.kind)
+
+_session_store = None
+_store_lock = threading.Lock()
+
+def get_session_store() -> SessionStore:
+    # opened (recovered, evictor started) on first use rather than at import
+    global _session_store
+    if _session_store is None:
+        with _store_lock:
+            if _session_store is None:
+                store = SessionStore(SESSION_DIR, SESSION_TTL, SESSION_USER_MAX_BYTES, SESSION_TOTAL_MAX_BYTES,
+                                     recover=SESSION_RECOVER)
+                store.start_evictor()
+                _session_store = store
+    return _session_store
+
+user_sessions = _SessionMap(get_session_store)        # chat_id -> session dict
+merge_vcf_store = _Collection(get_session_store, "vcf")  # chat_id -> uploaded VCF files
+merge_txt_store = _Collection(get_session_store, "txt")  # chat_id -> uploaded TXT files
+
+# ---------------------------
+# conversion cache
+# ---------------------------
+# Parsed contact lists and uploaded output file_ids keyed by Telegram's
+# file_unique_id plus the options that shaped them. Small in-memory LRU
+# (bounded by contact count) in front of JSON files (bounded by bytes) in a
+# private directory; JSON rather than pickle so a planted file can't run code.
+def private_dir(path: str) -> str:
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.stat(path)
+    if st.st_uid != os.getuid():
+        raise PermissionError(f"{path} is owned by another user; set CACHE_DIR to a private directory")
+    if st.st_mode & 0o077:
+        os.chmod(path, 0o700)
+    return path
+
+def _thaw(value):
+    # JSON has no tuples: parse results are (contacts, dropped) of (name, phone) pairs
+    if isinstance(value, list) and len(value) == 2 and isinstance(value[0], list) and isinstance(value[1], int):
+        return [tuple(c) for c in value[0]], value[1]
+    return value
+
+class ConversionCache:
+    def __init__(self, root: str, mem_contacts: int, disk_bytes: int):
+        self.root = private_dir(root)
+        for e in os.scandir(root):
+            if e.name.endswith(".pkl"):   # pickle cache of older versions; never loaded
+                os.unlink(e.path)
+        self.mem_contacts = mem_contacts
+        self.disk_bytes = disk_bytes
+        self._mem = OrderedDict()   # key -> (weight, value)
+        self._mem_weight = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def _key(parts) -> str:
+        return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _weight(value) -> int:
+        if isinstance(value, tuple) and value and isinstance(value[0], list):
+            return len(value[0]) or 1
+        return 1
+
+    def get(self, *parts):
+        key = self._key(parts)
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                self.stats["hits"] += 1
+                return self._mem[key][1]
+        path = os.path.join(self.root, key + ".json")
+        try:
+            with open(path, "rb") as fh:
+                value = _thaw(json.load(fh))
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.stats["misses"] += 1
+            return None
+        with self._lock:
+            self.stats["hits"] += 1
+        self._remember(key, value)
+        return value
+
+    def put(self, value, *parts):
+        key = self._key(parts)
+        self._remember(key, value)
+        path = os.path.join(self.root, key + ".json")
+        tmp = f"{path}.{os.getpid()}.tmp"   # worker processes share CACHE_DIR
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(value, fh, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+        self._trim_disk()
+
+    def _remember(self, key, value):
+        weight = self._weight(value)
+        if weight > self.mem_contacts:
+            return
+        with self._lock:
+            old = self._mem.pop(key, None)
+            if old:
+                self._mem_weight -= old[0]
+            self._mem[key] = (weight, value)
+            self._mem_weight += weight
+            while self._mem_weight > self.mem_contacts:
+                _, (w, _) = self._mem.popitem(last=False)
+                self._mem_weight -= w
+
+    def _trim_disk(self):
+        entries = []
+        for e in os.scandir(self.root):
+            if e.name.endswith(".json"):
+                st = e.stat()
+                entries.append((st.st_mtime, st.st_size, e.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.disk_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+_conversion_cache = None
+
+def get_conversion_cache() -> ConversionCache:
+    global _conversion_cache
+    if _conversion_cache is None:
+        with _store_lock:
+            if _conversion_cache is None:
+                _conversion_cache = ConversionCache(CACHE_DIR, CACHE_MEM_CONTACTS, CACHE_DISK_BYTES)
+    return _conversion_cache
+
+# ---------------------------
+# conversion tasks
+# ---------------------------
+class CpuTimeout(Exception):
+    pass
+
+def terminate_pool(pool: ProcessPoolExecutor):
+    # ProcessPoolExecutor has no public way to stop a worker stuck in a task;
+    # every task still on the pool then fails with BrokenProcessPool (not
+    # CancelledError), so callers can tell a lost task from a cancelled one
+    for proc in list((getattr(pool, "_processes", None) or {}).values()):
+        proc.terminate()
+    pool.shutdown(wait=False)
+
+def _temp_path(suffix: str) -> str:
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    return path
+
+# CPU-side tasks; module level so the process pool can pickle them
+@contextmanager
+def _open_source(src):
+    # downloads arrive as a Path on disk; bytes and file objects pass through
+    if isinstance(src, Path):
+        with open(src, "rb") as fh:
+            yield fh
+    else:
+        yield src
+
+def vcf_to_txt_file(src: Union[bytes, Path], path: str) -> int:
+    count = 0
+    with open(path, "wb") as out, _open_source(src) as b:
+        for n,p in iter_vcf_contacts(b):
+            if count:
+                out.write(b"\n")
+            out.write(f"{n}|{p}".encode('utf-8'))
+            count += 1
+    return count
+
+def merge_vcf_file(paths: List[str], path: str, dedup: str = None) -> Tuple[int,int]:
+    stats = {"dropped": 0}
+    def contacts_from(p):
+        with open(p, "rb") as fh:
+            yield from iter_vcf_contacts(fh)
+    contacts = itertools.chain.from_iterable(contacts_from(p) for p in paths)
+    if dedup:
+        contacts = dedup_contacts(contacts, dedup, stats)
+    with open(path, "wb") as out:
+        return write_vcf(contacts, out), stats["dropped"]
+
+def _read_text(path: str) -> str:
+    with open(path, "rb") as fh:
+        return fh.read().decode('utf-8', errors='ignore')
+
+def merge_txt_file(paths: List[str], path: str, dedup: str = None) -> Tuple[int,int]:
+    # without dedup the raw files are joined; "first" keeps the first raw line
+    # per number, "merge" rewrites the output as name|phone lines
+    lines = 0
+    dropped = 0
+    with open(path, "wb") as out:
+        if dedup == "merge":
+            stats = {}
+            contacts = itertools.chain.from_iterable(parse_txt_contacts(_read_text(p), DEFAULT_COUNTRY_CODE) for p in paths)
+            for n,p in dedup_contacts(contacts, "merge", stats):
+                out.write(("\n" if lines else "").encode('utf-8') + f"{n}|{p}".encode('utf-8'))
+                lines += 1
+            return lines, stats["dropped"]
+        seen = set()
+        for p in paths:
+            if not dedup:
+                with open(p, "rb") as fh:
+                    if lines:
+                        out.write(b"\n")
+                    shutil.copyfileobj(fh, out)
+                lines += 1
+                continue
+            for raw in _read_text(p).splitlines():
+                parsed = parse_txt_contacts(raw, DEFAULT_COUNTRY_CODE)
+                if parsed:
+                    k = _dedup_key(parsed[0][1])
+                    if k in seen:
+                        dropped += 1; continue
+                    seen.add(k)
+                out.write((b"\n" if lines else b"") + raw.encode('utf-8'))
+                lines += 1
+    return lines, dropped
+
+def parse_and_dedup(dedup, parse_fn, src, *args) -> Tuple[List[Tuple[str,str]], int]:
+    with _open_source(src) as fh:
+        contacts = parse_fn(fh, *args)
+    if not dedup:
+        return contacts, 0
+    stats = {}
+    contacts = list(dedup_contacts(contacts, dedup, stats))
+    return contacts, stats["dropped"]
+
+# ---------------------------
+# split chunks
+# ---------------------------
+def build_vcf_chunk(contacts: List[Tuple[str,str]], path: str) -> int:
+    with open(path, "wb") as out:
+        return write_vcf(contacts, out)
+
+def build_txt_chunk(contacts: List[Tuple[str,str]], path: str) -> int:
+    with open(path, "wb") as out:
+        out.write("\n".join(f"{n}|{p}" for n,p in contacts).encode('utf-8'))
+    return len(contacts)
+
+def bundle_zip(files: List[Tuple[str,str]], out_prefix: str, level: int, max_bytes: int) -> List[str]:
+    # stream (path, arcname) pairs into as few archives as the size cap allows
+    archives = []
+    zf = None
+    size = 0
+    try:
+        for path, arcname in files:
+            fsize = os.path.getsize(path)
+            if zf is None or (size and size + fsize > max_bytes):
+                if zf is not None:
+                    zf.close()
+                archives.append(f"{out_prefix}{len(archives) + 1}.zip")
+                zf = zipfile.ZipFile(archives[-1], "w", zipfile.ZIP_DEFLATED, compresslevel=level)
+                size = 0
+            zf.write(path, arcname)
+            size += zf.infolist()[-1].compress_size
+    finally:
+        if zf is not None:
+            zf.close()
+    return archives
+
+def _with_suffix(name: str, suffix: str) -> str:
+    return name if name.lower().endswith(suffix) else name + suffix
+
+# ---------------------------
+# help text
+# ---------------------------
+HELP_TEXT = f"""
+📚 Commands & who can use them:
+
+Public / Allowed:
+ - /help
+ - /txt2vcf     -> interactive: upload TXT doc
+ - /xlsx2vcf    -> interactive: upload XLSX or CSV
+ - /vcf2txt     -> upload VCF -> returns TXT
+ - /merge_vcf   -> send many VCF docs then /done_merge
+ - /merge_txt   -> send many TXT docs then /done_merge_txt
+ - /split_vcf   -> upload VCF then specify per-file count
+ - /split_txt   -> upload TXT then specify per-file count
+ - /adminneavy  -> interactive Admin+Neavy VCF creator
+ - /resume      -> continue an interrupted conversion after its last sent file
+ Add 'dedup' (keep first) or 'dedup=merge' (join names) to /txt2vcf, /xlsx2vcf,
+ /split_vcf, /split_txt, /done_merge or /done_merge_txt to drop repeated numbers.
+
+Admin / Owner:
+ - /admin <admin_key>       (owner uses this)
+ - /adduser <telegram_user_id> [more ids...]
+ - /removeuser <telegram_user_id>  (owner cannot be removed)
+ - /addadmin <admin_key> <telegram_user_id>
+ - /removeadmin <admin_key> <telegram_user_id>
+ - /profile                 (cProfile report for your next request)
+
+Notes:
+ - Default admin key: {ADMIN_KEY}
+ - Unauthorized users see: 'Purchase access from @random_0988'
+ - Attempt to remove owner -> 'BAAP SE PANGA NHI 😁'
+"""
+
+# ---------------------------
+# startup prewarm
+# ---------------------------
+def prewarm():
+    # pay the heavy imports and DB open off the critical path; forked CPU
+    # workers started afterwards inherit the loaded modules
+    t0 = time.perf_counter()
+    try:
+        import openpyxl, pandas  # noqa: F401
+        _acl_snapshot()
+    except Exception:
+        traceback.print_exc()
+    startup_phases["prewarm (background)"] = time.perf_counter() - t0
+
+_prewarm_thread = None
+
+def start_prewarm():
+    global _prewarm_thread
+    if STARTUP_PREWARM:
+        _prewarm_thread = threading.Thread(target=prewarm, name="prewarm", daemon=True)
+        _prewarm_thread.start()
+
+def prewarm_pending() -> bool:
+    return _prewarm_thread is not None and _prewarm_thread.is_alive()
+
+def wait_prewarm():
+    if _prewarm_thread is not None:
+        _prewarm_thread.join()